@@ -1,10 +1,13 @@
 import logging
+import sqlite3
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_cors import CORS, cross_origin
 from flask_restful import Api
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from config import Config
 from logging.handlers import SMTPHandler
@@ -26,19 +29,33 @@ login = LoginManager(app)
 login.login_view = 'login'
 api = Api(app, "/api")
 
+
+@event.listens_for(Engine, "connect")
+def sqlite_profile(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    if app.config['SQLITE_JOURNAL_MODE']:
+        cursor.execute('PRAGMA journal_mode={}'.format(app.config['SQLITE_JOURNAL_MODE']))
+    if app.config['SQLITE_SYNCHRONOUS']:
+        cursor.execute('PRAGMA synchronous={}'.format(app.config['SQLITE_SYNCHRONOUS']))
+    cursor.execute('PRAGMA busy_timeout={:d}'.format(app.config['SQLITE_BUSY_TIMEOUT']))
+    cursor.close()
+
 # cors
 # cors = CORS(app, resources)
 
 
-from app import routes, models, errors
+from app import routes, models, errors, metrics
 from app.resources.audio_category import AudioCategoryRes, AudioCategoryListRes
-from app.resources.audio import AudioRes, AudioListRes
+from app.resources.audio import AudioRes, AudioListRes, AudioFileRes
 from app.resources.program import ProgramRes, ProgramListRes
 
 
 api.add_resource(AudioCategoryRes, "/audios/categories/<int:ac_id>")
 api.add_resource(AudioCategoryListRes, "/audios/categories")
 api.add_resource(AudioRes, "/audios/<int:audio_id>")
+api.add_resource(AudioFileRes, "/audios/<int:audio_id>/file")
 api.add_resource(AudioListRes, "/audios")
 api.add_resource(ProgramRes, "/programs/<int:program_id>")
 api.add_resource(ProgramListRes, "/programs")
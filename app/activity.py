@@ -0,0 +1,90 @@
+import time
+import atexit
+import threading
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from app import app, db, login
+from app.models import User
+
+
+class LastSeenBuffer(object):
+    # last_seen stamps kept in memory and written in one batch every interval
+    # seconds or once threshold users are pending, read requests don't write
+
+    def __init__(self, interval=60, threshold=100):
+        self.interval = interval
+        self.threshold = threshold
+        self.pending = {}
+        self.flushed = time.time()
+        self.lock = threading.Lock()
+
+    def touch(self, user_id, when=None):
+        with self.lock:
+            self.pending[user_id] = when or datetime.utcnow()
+            due = len(self.pending) >= self.threshold or time.time() - self.flushed >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushed = time.time()
+        if not pending:
+            return
+        table = User.__table__
+        statement = table.update().where(table.c.id == bindparam('user_id')).values(last_seen=bindparam('seen'))
+        try:
+            db.session.execute(statement, [{'user_id': user_id, 'seen': seen} for user_id, seen in pending.items()])
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            app.logger.error(exc)
+            # keep the stamps for the next flush unless newer ones arrived
+            with self.lock:
+                for user_id, seen in pending.items():
+                    self.pending.setdefault(user_id, seen)
+
+
+class UserCache(object):
+    # detached User rows for flask-login, reloaded after ttl seconds
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.users = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.time()
+        with self.lock:
+            cached = self.users.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        db.session.expunge(user)
+        with self.lock:
+            self.users[user_id] = (now + self.ttl, user)
+        return user
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+
+
+last_seen = LastSeenBuffer(app.config['LAST_SEEN_FLUSH_INTERVAL'], app.config['LAST_SEEN_FLUSH_THRESHOLD'])
+user_cache = UserCache(app.config['USER_CACHE_TTL'])
+
+
+@login.user_loader
+def load_user(id):
+    return user_cache.get(int(id))
+
+
+@atexit.register
+def flush_last_seen():
+    with app.app_context():
+        last_seen.flush()
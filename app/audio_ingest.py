@@ -0,0 +1,94 @@
+import os
+import wave
+import audioop
+import subprocess
+import tempfile
+
+# format of the playback device, every clip is stored ready to be written to it
+PLAYBACK_RATE = 44100
+PLAYBACK_CHANNELS = 1
+PLAYBACK_WIDTH = 2
+
+PCM_SUFFIX = '.pcm.wav'
+
+
+def pcm_path(filepath):
+    if filepath.endswith(PCM_SUFFIX):
+        return filepath
+    return os.path.splitext(filepath)[0] + PCM_SUFFIX
+
+
+def is_playback_format(wf):
+    return (wf.getframerate() == PLAYBACK_RATE and wf.getnchannels() == PLAYBACK_CHANNELS
+            and wf.getsampwidth() == PLAYBACK_WIDTH)
+
+
+def decode_mp3(filepath, wav_path):
+    # the only fork left, once per upload
+    subprocess.run(['/usr/bin/mpg321', '-q', '-w', wav_path, filepath], check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def normalise(src, dst):
+    # convert a wav file to the playback format
+    with wave.open(src, 'rb') as wf:
+        width = wf.getsampwidth()
+        channels = wf.getnchannels()
+        rate = wf.getframerate()
+        data = wf.readframes(wf.getnframes())
+
+    if width == 1:
+        # 8 bit wav is unsigned
+        data = audioop.bias(data, 1, -128)
+    if width != PLAYBACK_WIDTH:
+        data = audioop.lin2lin(data, width, PLAYBACK_WIDTH)
+    if channels == 2 and PLAYBACK_CHANNELS == 1:
+        data = audioop.tomono(data, PLAYBACK_WIDTH, 0.5, 0.5)
+    elif channels == 1 and PLAYBACK_CHANNELS == 2:
+        data = audioop.tostereo(data, PLAYBACK_WIDTH, 1, 1)
+    elif channels != PLAYBACK_CHANNELS:
+        raise ValueError('unsupported channel count {}'.format(channels))
+    if rate != PLAYBACK_RATE:
+        data = audioop.ratecv(data, PLAYBACK_WIDTH, PLAYBACK_CHANNELS, rate, PLAYBACK_RATE, None)[0]
+
+    tmp_path = dst + '.tmp'
+    with wave.open(tmp_path, 'wb') as out:
+        out.setnchannels(PLAYBACK_CHANNELS)
+        out.setsampwidth(PLAYBACK_WIDTH)
+        out.setframerate(PLAYBACK_RATE)
+        out.writeframes(data)
+    os.replace(tmp_path, dst)
+
+
+def ingest(filepath):
+    # decode and normalise an audio file once, returns the pcm wav to play
+    dst = pcm_path(filepath)
+    if filepath.lower().endswith('.mp3'):
+        fd, wav_path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            decode_mp3(filepath, wav_path)
+            normalise(wav_path, dst)
+        finally:
+            os.remove(wav_path)
+    else:
+        normalise(filepath, dst)
+    return dst
+
+
+def playable(filepath):
+    # pcm version of a clip, ingesting files stored before ingest existed
+    dst = pcm_path(filepath)
+    if os.path.exists(dst):
+        return dst
+    if filepath.lower().endswith('.wav'):
+        with wave.open(filepath, 'rb') as wf:
+            if is_playback_format(wf):
+                return filepath
+    return ingest(filepath)
+
+
+def remove(filepath):
+    dst = pcm_path(filepath)
+    if dst != filepath and os.path.exists(dst):
+        os.remove(dst)
@@ -0,0 +1,117 @@
+import sys
+from collections import deque
+
+
+class FsmError(Exception):
+    pass
+
+
+class StateRecord(object):
+    __slots__ = ('id', 'name', 'on_enter')
+
+    def __init__(self, id, name, on_enter=None):
+        self.id = id
+        self.name = name
+        self.on_enter = on_enter
+
+
+class FsmTable(object):
+    # the states and transitions lists of a compiled program as interned
+    # state ids and a (state id, trigger) -> state id dict; read only once
+    # built, so robots running the same program can share it
+
+    __slots__ = ('records', 'ids', 'table', 'initial')
+
+    def __init__(self, states, transitions, initial='init'):
+        self.records = []
+        self.ids = {}
+        for state in states:
+            name = sys.intern(state['name'])
+            if name in self.ids:
+                raise FsmError('duplicate state {}'.format(name))
+            self.ids[name] = len(self.records)
+            self.records.append(StateRecord(len(self.records), name, state.get('on_enter')))
+
+        self.table = {}
+        for transition in transitions:
+            trigger = sys.intern(transition['trigger'])
+            source = transition['source']
+            if source == '*':
+                sources = range(len(self.records))
+            else:
+                sources = [self.id(name) for name in ([source] if isinstance(source, str) else source)]
+            dest = transition['dest']
+            dest_id = None if dest == '=' else self.id(dest)
+            for source_id in sources:
+                # the first transition added for a trigger wins, as in transitions
+                self.table.setdefault((source_id, trigger), source_id if dest_id is None else dest_id)
+        self.initial = self.id(initial)
+
+    def id(self, name):
+        try:
+            return self.ids[name]
+        except KeyError:
+            raise FsmError('unknown state {}'.format(name))
+
+    def triggers(self, state_id):
+        return [trigger for source_id, trigger in self.table if source_id == state_id]
+
+
+class FsmCore(object):
+    # runs an FsmTable on the object itself: on_enter names are methods of
+    # the subclass, before/after_state_change are method names or callables
+    # run around every transition, reflexive ones included. queued triggers
+    # fired while a transition runs wait in a deque drained by one flat loop
+
+    def __init__(self, table, queued=True, ignore_invalid_triggers=True,
+                 before_state_change=None, after_state_change=None):
+        self.fsm_table = table
+        self.fsm_queued = queued
+        self.ignore_invalid_triggers = ignore_invalid_triggers
+        self.before_state_change = self.callbacks(before_state_change)
+        self.after_state_change = self.callbacks(after_state_change)
+        self.fsm_queue = deque()
+        self.state_id = table.initial
+        self.state = table.records[table.initial].name
+
+    def callbacks(self, names):
+        if names is None:
+            return []
+        if isinstance(names, str) or callable(names):
+            names = [names]
+        return [getattr(self, name) if isinstance(name, str) else name for name in names]
+
+    def trigger(self, name):
+        if not self.fsm_queued:
+            return self.transition(name)
+        self.fsm_queue.append(name)
+        if len(self.fsm_queue) > 1:
+            return True
+        try:
+            while self.fsm_queue:
+                self.transition(self.fsm_queue[0])
+                self.fsm_queue.popleft()
+        except Exception:
+            self.fsm_queue.clear()
+            raise
+        return True
+
+    def transition(self, name):
+        dest = self.fsm_table.table.get((self.state_id, name))
+        if dest is None:
+            if self.ignore_invalid_triggers:
+                return False
+            raise FsmError("can't trigger {} from state {}".format(name, self.state))
+        for callback in self.before_state_change:
+            callback()
+        record = self.fsm_table.records[dest]
+        self.state_id = dest
+        self.state = record.name
+        if record.on_enter is not None:
+            getattr(self, record.on_enter)()
+        for callback in self.after_state_change:
+            callback()
+        return True
+
+    def is_state(self, name):
+        return self.state == name
@@ -1,14 +1,21 @@
 import os
 import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from app.robot import TestVoice, CholitaTraction
 
-from transitions import Machine
-
-from app import app, db
+from app import app, db, metrics
+from app.fsm_core import FsmCore, FsmTable
 from app.models import User, Audio, Program, Action
 
 
-class Robot(Machine):
+# bump when the layout of the compiled fsm changes
+COMPILED_VERSION = 2
+
+
+class Robot(FsmCore):
     states = []
     transitions = []
     audio_data = {}
@@ -17,8 +24,18 @@ class Robot(Machine):
     grammar_data = {}
     trigger_data = {}
     action_data = {}
-
-    def __init__(self, data_dic):
+    search_data = {}
+    grammars = {}
+    audio_files = {}
+    actions = {}
+    # RunTrace of the current run, set by the runner
+    trace = None
+
+    def __init__(self, data_dic, engine=None, player=None, traction=None):
+        # player and traction can be injected (simulated devices), otherwise
+        # the voice comes from the engine or a private TestVoice
+        self.engine = engine if player is None else None
+        self.traction = traction
         if data_dic:
             self.states = data_dic['states']
             self.transitions = data_dic['transitions']
@@ -28,40 +45,127 @@ class Robot(Machine):
             self.grammar_data = data_dic['grammar_data']
             self.trigger_data = data_dic['trigger_data']
             self.action_data = data_dic['action_data']
-            
-            self.local = data_dic['local_proc']
-            self.player = TestVoice(local=self.local)
-            # available only when deployed in a raspberry pi
-            if app.config['RASPI']:
-                self.traction = CholitaTraction()
+            self.search_data = data_dic['search_data']
+            self.grammars = data_dic['grammars']
+            self.audio_files = data_dic['audio_files']
+            self.actions = data_dic['actions']
 
-        # init fsm part
-            Machine.__init__(self,
-                            states=self.states,
-                            transitions=self.transitions,
-                            initial='init',
-                            ignore_invalid_triggers=True)
+            self.local = data_dic['local_proc']
+            # on_enter callback of every state, the label of its metrics
+            self.kinds = {state['name']: state.get('on_enter', state['name']) for state in self.states}
+            self.state_started = None
+            self.answer_from = None
+            # the voice and the devices are taken by open(), in the worker
+            # thread that runs the program, never in the request that queued it
+            self.player = player
+            self.acquired = False
+
+            # init fsm part, the table comes compiled with cached programs
+            # queued: triggers fired from on_enter callbacks are drained by a flat
+            # loop in begin() instead of nesting, so the stack depth stays constant
+            table = data_dic.get('table') or FsmTable(self.states, self.transitions, initial='init')
+            FsmCore.__init__(self, table,
+                             queued=app.config['FSM_QUEUED'],
+                             ignore_invalid_triggers=True,
+                             before_state_change='stateLeaving',
+                             after_state_change='stateEntered')
         else:
             pass
 
+    def open(self):
+        if self.player is None:
+            if self.engine:
+                self.player = self.engine.acquire(self.local, app.config['VOICE_WARMUP_TIMEOUT'])
+                self.acquired = True
+            else:
+                self.player = TestVoice(local=self.local)
+
+        try:
+            # every grammar of the program becomes a named decoder search
+            for name, jsgf in self.grammars.items():
+                with metrics.GRAMMAR_SECONDS.labels('add').time():
+                    self.player.addGrammar(name, jsgf)
+            # available only when deployed in a raspberry pi
+            if self.traction is None and app.config['RASPI']:
+                self.traction = CholitaTraction()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        # give the shared voice back, or free a private one
+        if self.engine:
+            if self.acquired:
+                self.engine.release()
+                self.acquired = False
+        elif self.player is not None:
+            self.player.close()
+
     def isRunning(self):
         return not self.is_oblivion()
 
-    def doThings(self):
-        if self.state in self.audio_data:
-            filename = Audio.query.filter_by(id=self.audio_data[self.state]).first().filepath
+    def begin(self):
+        return self.trigger('begin')
+
+    def is_oblivion(self):
+        return self.state == 'oblivion'
+
+    def stateLeaving(self):
+        metrics.STATE_EXITED.labels(self.kinds.get(self.state, self.state)).inc()
+        self.state_started = time.monotonic()
+
+    def stateEntered(self):
+        # queued triggers run after on_enter returns, so this closes the state's work
+        kind = self.kinds.get(self.state, self.state)
+        metrics.STATE_ENTERED.labels(kind).inc()
+        if self.state_started is not None:
+            elapsed = time.monotonic() - self.state_started
+            metrics.STATE_SECONDS.labels(kind).observe(elapsed)
+            if self.trace is not None:
+                self.trace.add('state', self.state, self.state_started, elapsed, kind)
+
+    def fire(self, trigger):
+        if self.trace is not None:
+            self.trace.add('trigger', trigger)
+        self.trigger(trigger)
+
+    def answering(self):
+        # first output after a recognition, time since the user stopped speaking
+        if self.answer_from is not None:
+            metrics.RESPONSE_SECONDS.observe(time.monotonic() - self.answer_from)
+            self.answer_from = None
+
+    def say(self, phrase):
+        self.answering()
+        start = time.monotonic()
+        with metrics.SPEAK_SECONDS.time():
+            self.player.speak(phrase)
+        if self.trace is not None:
+            self.trace.add('speak', self.state, start, time.monotonic() - start, phrase)
+
+    def playFile(self, filename):
+        self.answering()
+        start = time.monotonic()
+        with metrics.PLAY_SECONDS.time():
             self.player.play(filename)
+        if self.trace is not None:
+            self.trace.add('play', self.state, start, time.monotonic() - start, os.path.basename(filename))
+
+    def doThings(self):
+        # audio files and actions were resolved when the program was loaded
+        if self.state in self.audio_files:
+            self.playFile(self.audio_files[self.state])
 
         if self.state in self.tts_data:
             phrase = self.tts_data[self.state]
-            self.player.speak(phrase)
+            self.say(phrase)
 
-        if self.state in self.action_data:
-            action = Action.query.filter_by(id=self.action_data[self.state]).first()
-            if app.config['RASPI']:
+        if self.state in self.actions:
+            action = self.actions[self.state]
+            if self.traction is not None:
 
-                category = action.category
-                thingToDo = action.action
+                category = action['category']
+                thingToDo = action['action']
 
                 if category == 'traction':
                     self.traction.move(thingToDo)
@@ -72,15 +176,15 @@ class Robot(Machine):
         # if self.state in self.
         if self.state in self.tts_data.keys():
             phrase = self.tts_data[self.state]
-            self.player.speak(phrase)
+            self.say(phrase)
 
 
-        self.trigger('end')
+        self.fire('end')
         
     def audio(self):
         self.doThings()
 
-        self.trigger('end')
+        self.fire('end')
 
 
 
@@ -88,7 +192,7 @@ class Robot(Machine):
         print('iniciando!')
         self.doThings()
 
-        self.trigger('end')
+        self.fire('end')
 
     def terminate(self):
         self.doThings()
@@ -97,39 +201,29 @@ class Robot(Machine):
 
     def recognition(self):
         print('reconociendo...')
-        # check if generic
-        if self.state in self.grammar_data:
-            # generate grammar
-            template_file = os.path.join(app.config['GRAMMARS_FOLDER'], app.config['GRAMMAR_TEMPLATE'])
-
-            with open(template_file, 'r') as f:
-                grammar_str = f.read().replace('##commands##', self.grammar_data[self.state])
-
-            # save grammar
-            filename = 'auxiliar.gram'
-            filepath = os.path.join(app.config['GRAMMARS_FOLDER'], filename)
-
-            # save json file
-            with open(filepath, 'w') as out:
-                out.write(grammar_str)
-
-            # load grammar
-            self.player.loadGrammar('auxiliar')
-
-        # if not generic
-        else:
-            print("cargando gramatica...")
-            self.player.loadGrammar(self.recognition_data[self.state]['grammar'])
+        with metrics.GRAMMAR_SECONDS.labels('use').time():
+            self.player.useGrammar(self.search_data[self.state])
 
+        start = time.monotonic()
         output = self.player.recognize()
+        elapsed = time.monotonic() - start
+        metrics.RECOGNIZE_SECONDS.labels('recognized' if output else 'silence').observe(elapsed)
+        if self.trace is not None:
+            self.trace.add('recognize', self.state, start, elapsed, output)
         if output:
+            # the vad end of speech when the voice knows it, else the decode end
+            self.answer_from = getattr(self.player, 'speech_ended', None) or time.monotonic()
             print(output)
             if self.state in self.trigger_data:
-                self.trigger(self.trigger_data[self.state][output])
+                self.fire(self.trigger_data[self.state][output])
             else:
-                self.trigger(output)
+                self.fire(output)
         else:
-            self.trigger('retry')
+            self.fire('retry')
+
+
+class InvalidProgram(ValueError):
+    pass
 
 
 class JsonFsm(object):
@@ -149,12 +243,14 @@ class JsonFsm(object):
         self.states = []
         self.transitions = []
         self.action_data = {}
+        self.search_data = {}
+        self.grammars = {}
 
     def loadFSM(self, filepath, local=True):
         print('reiniciando fsm')
         self.filepath = filepath
         self.load()
-        fsm_dic = self.parse()
+        fsm_dic = self.resolve(self.parse())
         fsm_dic['local_proc'] = local
         return Robot(fsm_dic)
 
@@ -165,6 +261,111 @@ class JsonFsm(object):
             diagram = json.load(f)
         self.json_data = diagram['nodes']
 
+    def compile(self, diagram):
+        # validate the diagram and build the fsm tables, raises InvalidProgram
+        if not isinstance(diagram, dict) or not isinstance(diagram.get('nodes'), dict):
+            raise InvalidProgram('diagram has no nodes')
+        self.json_data = diagram['nodes']
+        self.validate()
+        try:
+            return self.parse()
+        except (KeyError, TypeError, AttributeError) as exc:
+            raise InvalidProgram('malformed node data: {}'.format(exc))
+
+    def validate(self):
+        if not self.json_data:
+            raise InvalidProgram('diagram is empty')
+
+        presentations = 0
+        terminates = 0
+        for node, data in self.json_data.items():
+            if not isinstance(data, dict) or 'name' not in data or not isinstance(data.get('outputs'), dict):
+                raise InvalidProgram('node {} is malformed'.format(node))
+
+            name = data['name'].lower()
+            if 'presentation' in name:
+                presentations += 1
+            if 'terminate' in name:
+                terminates += 1
+
+            if 'recognition' in name:
+                output_str = name[13:]
+                if output_str.isdigit():
+                    if not data.get('data'):
+                        raise InvalidProgram('recognition node {} has no commands'.format(node))
+                    for out in data['data']:
+                        if out not in data['outputs']:
+                            raise InvalidProgram('recognition node {} has no output {}'.format(node, out))
+                else:
+                    grammar_file = os.path.join(app.config['GRAMMARS_FOLDER'], output_str + '.gram')
+                    if not os.path.exists(grammar_file):
+                        raise InvalidProgram('grammar {} not found for node {}'.format(output_str, node))
+
+            for out_name, out in data['outputs'].items():
+                for connection in out.get('connections', []):
+                    if str(connection.get('node')) not in self.json_data:
+                        raise InvalidProgram('output {} of node {} points to unknown node {}'.format(
+                            out_name, node, connection.get('node')))
+
+        if presentations != 1:
+            raise InvalidProgram('diagram needs exactly one presentation node, found {}'.format(presentations))
+        if terminates < 1:
+            raise InvalidProgram('diagram needs a terminate node')
+
+    @staticmethod
+    def resolve(fsm_dic):
+        # one IN query per table for every audio and action the program uses,
+        # so entering a state never touches the database
+        fsm_dic = dict(fsm_dic)
+
+        audio_ids = set(fsm_dic['audio_data'].values())
+        audios = {}
+        if audio_ids:
+            audios = dict(db.session.query(Audio.id, Audio.filepath).filter(Audio.id.in_(audio_ids)))
+        missing = audio_ids - set(audios)
+        if missing:
+            raise InvalidProgram('audio not found: {}'.format(', '.join(str(i) for i in sorted(missing))))
+
+        action_ids = set(fsm_dic['action_data'].values())
+        actions = {}
+        if action_ids:
+            rows = db.session.query(Action.id, Action.category, Action.action).filter(Action.id.in_(action_ids))
+            actions = {row.id: {'category': row.category, 'action': row.action} for row in rows}
+        missing = action_ids - set(actions)
+        if missing:
+            raise InvalidProgram('action not found: {}'.format(', '.join(str(i) for i in sorted(missing))))
+
+        fsm_dic['audio_files'] = {state: audios[audio_id] for state, audio_id in fsm_dic['audio_data'].items()}
+        fsm_dic['actions'] = {state: actions[action_id] for state, action_id in fsm_dic['action_data'].items()}
+        return fsm_dic
+
+    @staticmethod
+    def compiledPath(filepath):
+        return os.path.splitext(filepath)[0] + '.fsm'
+
+    @classmethod
+    def saveCompiled(cls, filepath, fsm_dic):
+        with open(cls.compiledPath(filepath), 'w') as out:
+            json.dump({'version': COMPILED_VERSION, 'fsm': fsm_dic}, out, separators=(',', ':'))
+
+    @classmethod
+    def loadCompiled(cls, filepath):
+        # returns None when the artifact is missing, stale or from an older compiler
+        compiled_path = cls.compiledPath(filepath)
+        if not os.path.exists(compiled_path) or os.path.getmtime(compiled_path) < os.path.getmtime(filepath):
+            return None
+        with open(compiled_path, 'r') as f:
+            compiled = json.load(f)
+        if compiled.get('version') != COMPILED_VERSION:
+            return None
+        return compiled['fsm']
+
+    @classmethod
+    def removeCompiled(cls, filepath):
+        compiled_path = cls.compiledPath(filepath)
+        if os.path.exists(compiled_path):
+            os.remove(compiled_path)
+
     def parse(self):
         # fill data arrays and dics
         print('parseando')
@@ -211,7 +412,7 @@ class JsonFsm(object):
                     self.recognition_data[state] = {'grammar': "generic", 'commands': rec_comm}
                 else:
 
-                    rec_comm = self.json_data[state[1:]]['outputs'].keys()
+                    rec_comm = list(self.json_data[state[1:]]['outputs'].keys())
                     self.recognition_data[state] = {'grammar': callback[13:], 'commands': rec_comm}
 
                 callback = 'recognition'
@@ -226,6 +427,18 @@ class JsonFsm(object):
 
             self.states.append({'name': state, 'on_enter': callback})
 
+        # recognition grammars, built once and shared by name
+        self.search_data = {}
+        self.grammars = {}
+        for state, rec in self.recognition_data.items():
+            if state in self.grammar_data:
+                jsgf = self.readGrammar(app.config['GRAMMAR_TEMPLATE']).replace('##commands##', self.grammar_data[state])
+            else:
+                jsgf = self.readGrammar(rec['grammar'] + '.gram')
+            name = 'g' + hashlib.sha1(jsgf.encode('utf-8')).hexdigest()[:16]
+            self.search_data[state] = name
+            self.grammars[name] = jsgf
+
         # dummy initial state
         self.states.append({'name': 'init'})
         # dummy final state
@@ -291,11 +504,18 @@ class JsonFsm(object):
             'tts_data': self.tts_data,
             'grammar_data': self.grammar_data,
             'trigger_data': self.trigger_data,
-            'action_data': self.action_data
+            'action_data': self.action_data,
+            'search_data': self.search_data,
+            'grammars': self.grammars
         }
 
         return data_dic
 
+    @staticmethod
+    def readGrammar(filename):
+        with open(os.path.join(app.config['GRAMMARS_FOLDER'], filename), 'r', encoding='utf-8-sig') as f:
+            return f.read()
+
     def checkData(self, state):
         c_audio = self.json_data[state[1:]]['data']
         if c_audio['key'] == 'audio' and 'audio' in c_audio:
@@ -304,3 +524,44 @@ class JsonFsm(object):
             self.tts_data[state] = c_audio['text']
         if 'action' in c_audio:
             self.action_data[state] = c_audio['action']
+
+
+class ProgramCache(object):
+    # compiled programs keyed by (program id, modified), least recently used first
+
+    def __init__(self, size=16):
+        self.size = size
+        self.programs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, program):
+        key = (program.id, program.modified)
+        with self.lock:
+            fsm_dic = self.programs.get(key)
+            if fsm_dic is not None:
+                self.programs.move_to_end(key)
+                return fsm_dic
+
+        fsm_dic = JsonFsm.loadCompiled(program.filepath)
+        if fsm_dic is None:
+            # programs saved before compilation existed
+            with open(program.filepath, 'r') as f:
+                fsm_dic = JsonFsm().compile(json.load(f))
+            JsonFsm.saveCompiled(program.filepath, fsm_dic)
+        # shared by every robot of this version, never written to disk
+        fsm_dic['table'] = FsmTable(fsm_dic['states'], fsm_dic['transitions'])
+
+        with self.lock:
+            self.programs[key] = fsm_dic
+            self.programs.move_to_end(key)
+            while len(self.programs) > self.size:
+                self.programs.popitem(last=False)
+        return fsm_dic
+
+    def discard(self, program_id):
+        with self.lock:
+            for key in [k for k in self.programs if k[0] == program_id]:
+                del self.programs[key]
+
+
+program_cache = ProgramCache(app.config['PROGRAM_CACHE_SIZE'])
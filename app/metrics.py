@@ -0,0 +1,96 @@
+import time
+
+from flask import g, request, has_request_context
+from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app
+
+# voice phases last seconds, queries milliseconds
+VOICE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 13.0, 21.0, 34.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# the robot's reaction after speech, tens of milliseconds to seconds
+REACTION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0)
+
+# http
+REQUESTS = Counter('nayra_http_requests_total', 'HTTP requests', ['method', 'endpoint', 'status'])
+REQUEST_SECONDS = Histogram('nayra_http_request_seconds', 'HTTP request latency', ['method', 'endpoint'])
+REQUEST_DB_SECONDS = Histogram('nayra_http_request_db_seconds', 'Database time per HTTP request',
+                               ['method', 'endpoint'], buckets=DB_BUCKETS)
+REQUEST_QUERIES = Histogram('nayra_http_request_queries', 'Database statements per HTTP request',
+                            ['method', 'endpoint'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+IN_PROGRESS = Gauge('nayra_http_requests_in_progress', 'HTTP requests being served')
+DB_SECONDS = Histogram('nayra_db_statement_seconds', 'Database statement latency', buckets=DB_BUCKETS)
+
+# robot runs
+RUNS = Counter('nayra_runs_total', 'Program runs', ['result'])
+RUN_SECONDS = Histogram('nayra_run_seconds', 'Program run duration', buckets=VOICE_BUCKETS + (60.0, 120.0, 300.0))
+STATE_ENTERED = Counter('nayra_robot_state_entered_total', 'States entered', ['kind'])
+STATE_EXITED = Counter('nayra_robot_state_exited_total', 'States left', ['kind'])
+STATE_SECONDS = Histogram('nayra_robot_state_seconds', 'Time spent in the on_enter work of a state',
+                          ['kind'], buckets=VOICE_BUCKETS)
+RECOGNIZE_SECONDS = Histogram('nayra_robot_recognize_seconds', 'Recognition latency, listening included',
+                              ['outcome'], buckets=VOICE_BUCKETS)
+DECODE_TAIL_SECONDS = Histogram('nayra_voice_decode_tail_seconds', 'End of speech to hypothesis',
+                                buckets=REACTION_BUCKETS)
+RESPONSE_SECONDS = Histogram('nayra_robot_response_seconds', 'End of speech to the start of the answer',
+                             buckets=REACTION_BUCKETS)
+SPEAK_SECONDS = Histogram('nayra_robot_speak_seconds', 'Speak, synthesis and playback', buckets=VOICE_BUCKETS)
+SYNTHESIS_SECONDS = Histogram('nayra_voice_synthesis_seconds', 'Text to speech synthesis, cache misses',
+                              ['engine'], buckets=VOICE_BUCKETS)
+PLAY_SECONDS = Histogram('nayra_robot_play_seconds', 'Audio clip playback', buckets=VOICE_BUCKETS)
+GRAMMAR_SECONDS = Histogram('nayra_robot_grammar_seconds', 'Grammar load and search switch', ['op'],
+                            buckets=DB_BUCKETS)
+
+
+def endpoint():
+    # the url rule keeps the label set small, unmatched urls share one label
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def start_request_timer():
+    g.metrics_start = time.perf_counter()
+    g.db_seconds = 0.0
+    g.db_queries = 0
+    IN_PROGRESS.inc()
+
+
+@app.after_request
+def record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    IN_PROGRESS.dec()
+    method, rule = request.method, endpoint()
+    REQUESTS.labels(method, rule, response.status_code).inc()
+    REQUEST_SECONDS.labels(method, rule).observe(time.perf_counter() - start)
+    REQUEST_DB_SECONDS.labels(method, rule).observe(g.db_seconds)
+    REQUEST_QUERIES.labels(method, rule).observe(g.db_queries)
+    return response
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_start'].pop()
+    DB_SECONDS.observe(elapsed)
+    if has_request_context() and 'db_seconds' in g:
+        g.db_seconds += elapsed
+        g.db_queries += 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def drop_statement_timer(context):
+    if context.connection is not None and context.connection.info.get('metrics_start'):
+        context.connection.info['metrics_start'].pop()
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
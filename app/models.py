@@ -1,6 +1,6 @@
 from datetime import datetime
 from hashlib import md5
-from app import db, login
+from app import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -29,11 +29,6 @@ class User(UserMixin, db.Model):
             digest, size)
 
 
-@login.user_loader
-def load_user(id):
-    return User.query.get(int(id))
-
-
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(140))
@@ -48,13 +43,22 @@ class Post(db.Model):
 class Audio(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), index=True, unique=True)
-    content = db.Column(db.String(128), index=True)
-    filepath = db.Column(db.String(120), index=True, unique=True)
-    modified = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    content = db.Column(db.String(128))
+    # several rows may share one stored file, deletes count the rows per filepath;
+    # content_hash is only the etag of the download
+    filepath = db.Column(db.String(120), index=True)
+    content_hash = db.Column(db.String(64))
+    modified = db.Column(db.DateTime, default=datetime.utcnow)
     category_id = db.Column(db.Integer, db.ForeignKey("audio_category.id"))
 
     category = db.relationship("AudioCategory", foreign_keys=[category_id])
 
+    # keyset pages of the listing, by category and by modified
+    __table_args__ = (
+        db.Index('ix_audio_category_id_id', 'category_id', 'id'),
+        db.Index('ix_audio_modified_id', 'modified', 'id'),
+    )
+
     def __repr__(self):
         return '<Audio {}>'.format(self.name)
 
@@ -63,7 +67,7 @@ class Audio(db.Model):
 class AudioCategory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), index=True, unique=True)
-    modified = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    modified = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return '<AudioCategory {}>'.format(self.name)
@@ -72,11 +76,17 @@ class AudioCategory(db.Model):
 class Program(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), index=True, unique=True)
-    description = db.Column(db.String(228), index=True)
+    description = db.Column(db.String(228))
     filepath = db.Column(db.String(120), index=True, unique=True)
-    modified = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    active = db.Column(db.Boolean, index=True, default=False)
-    
+    modified = db.Column(db.DateTime, default=datetime.utcnow)
+    active = db.Column(db.Boolean, default=False)
+
+    # only the running program is in the partial index
+    __table_args__ = (
+        db.Index('ix_program_modified_id', 'modified', 'id'),
+        db.Index('ix_program_active', 'id', sqlite_where=db.text('active = 1')),
+    )
+
     def __repr__(self):
         return '<Program {}>'.format(self.name)
 
@@ -94,7 +104,7 @@ class Word(db.Model):
 class VoiceCommand(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     command = db.Column(db.String(256), index=True, unique=True)
-    modified = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    modified = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return '<Voice Command {}>'.format(self.command)
@@ -103,8 +113,12 @@ class VoiceCommand(db.Model):
 # para las acciones
 class Action(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    category = db.Column(db.String(64), index=True, default="")
-    action = db.Column(db.String(64), index=True, default="")
+    category = db.Column(db.String(64), default="")
+    action = db.Column(db.String(64), default="")
+
+    __table_args__ = (
+        db.Index('ix_action_category_id', 'category', 'id'),
+    )
 
     def __repr__(self):
         return '<Action {},{}>'.format(self.category, self.action)
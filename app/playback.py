@@ -0,0 +1,167 @@
+import os
+import mmap
+import wave
+import queue
+import threading
+from collections import OrderedDict
+
+from app import audio_ingest
+
+
+class Clip(object):
+    __slots__ = ('filepath', 'file', 'map', 'offset', 'size', 'mtime')
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.mtime = os.path.getmtime(filepath)
+        self.file = open(filepath, 'rb')
+        try:
+            # wave stops reading right at the start of the data chunk
+            wf = wave.open(self.file, 'rb')
+            if not audio_ingest.is_playback_format(wf):
+                raise ValueError('{} is not in the playback format'.format(filepath))
+            self.size = wf.getnframes() * wf.getnchannels() * wf.getsampwidth()
+            self.offset = self.file.tell()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+
+    def data(self):
+        return memoryview(self.map)[self.offset:self.offset + self.size]
+
+    def close(self):
+        self.file.close()
+        try:
+            self.map.close()
+        except BufferError:
+            # still being written by the player, freed with its last view
+            pass
+
+
+class ClipCache(object):
+    # memory mapped pcm clips, least recently used closed first
+
+    def __init__(self, size=64):
+        self.size = size
+        self.clips = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, filepath):
+        with self.lock:
+            clip = self.clips.get(filepath)
+            if clip is not None and clip.mtime == os.path.getmtime(filepath):
+                self.clips.move_to_end(filepath)
+                return clip
+
+        clip = Clip(filepath)
+        with self.lock:
+            old = self.clips.pop(filepath, None)
+            self.clips[filepath] = clip
+            while len(self.clips) > self.size:
+                self.clips.popitem(last=False)[1].close()
+        # a clip being played keeps its map alive until the player drops it
+        if old is not None:
+            old.close()
+        return clip
+
+
+class Playback(object):
+    # one queued clip, done once it is in the device buffer or failed
+    __slots__ = ('clip', 'done', 'error')
+
+    def __init__(self, clip):
+        self.clip = clip
+        self.done = threading.Event()
+        self.error = None
+
+
+class Player(object):
+    # one long lived output stream fed by a thread, clips queue up back to back
+    # so consecutive audio states play without gaps. a failed write is given
+    # back to play() and the stream reopened for the next clip
+
+    # seconds play() waits beyond the length of the clip
+    WAIT_MARGIN = 10.0
+
+    def __init__(self, audio, clip_cache, chunk=4096, output_device=None):
+        self.audio = audio
+        self.clip_cache = clip_cache
+        self.chunk = chunk
+        self.output_device = output_device
+        self.stream = None
+        self.clips = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                # opened here so a missing device fails the caller, reopened
+                # by the thread after a write error
+                if self.stream is None:
+                    self.stream = self.openStream()
+                self.thread = threading.Thread(target=self.run, name='player', daemon=True)
+                self.thread.start()
+
+    def openStream(self):
+        return self.audio.open(format=self.audio.get_format_from_width(audio_ingest.PLAYBACK_WIDTH),
+                               channels=audio_ingest.PLAYBACK_CHANNELS,
+                               rate=audio_ingest.PLAYBACK_RATE,
+                               output=True,
+                               output_device_index=self.output_device,
+                               frames_per_buffer=self.chunk)
+
+    def closeStream(self):
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            try:
+                stream.stop_stream()
+                stream.close()
+            except Exception:
+                pass
+
+    def enqueue(self, filepath):
+        # returns a Playback whose done event is set once the last chunk of
+        # the clip is in the device buffer
+        self.start()
+        playback = Playback(self.clip_cache.get(filepath))
+        self.clips.put(playback)
+        return playback
+
+    def play(self, filepath):
+        # returns while the tail of the clip is still sounding, the next clip
+        # written right after it follows without a gap
+        playback = self.enqueue(filepath)
+        seconds = playback.clip.size / float(audio_ingest.PLAYBACK_RATE * audio_ingest.PLAYBACK_CHANNELS *
+                                             audio_ingest.PLAYBACK_WIDTH)
+        if not playback.done.wait(seconds + self.WAIT_MARGIN):
+            raise RuntimeError('playback of {} timed out'.format(filepath))
+        if playback.error is not None:
+            raise playback.error
+
+    def run(self):
+        step = self.chunk * audio_ingest.PLAYBACK_CHANNELS * audio_ingest.PLAYBACK_WIDTH
+        while True:
+            playback = self.clips.get()
+            if playback is None:
+                break
+            try:
+                if self.stream is None:
+                    self.stream = self.openStream()
+                data = playback.clip.data()
+                for pos in range(0, len(data), step):
+                    self.stream.write(data[pos:pos + step])
+            except Exception as exc:
+                playback.error = exc
+                self.closeStream()
+            finally:
+                playback.done.set()
+
+    def close(self):
+        with self.lock:
+            if self.thread is not None:
+                self.clips.put(None)
+                self.thread.join()
+                self.thread = None
+            self.closeStream()
@@ -1,12 +1,16 @@
 import datetime
 import os
 
+from flask import request, send_file
 from flask_restful import Resource, abort, fields, marshal_with, reqparse
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
 from app import app, db
 from app.models import Audio, AudioCategory
+from app import audio_ingest
+from app.storage import audio_store
+from app.resources.listing import list_resource
 
 
 ALLOWED_EXTENSIONS = ["wav", "mp3"]
@@ -65,18 +69,19 @@ class AudioRes(Resource):
     def delete(self, audio_id: int):
         audio = Audio.query.filter_by(id=audio_id).first()
         self.check_audio(audio)
-        if os.path.exists(audio.filepath):
-            os.remove(audio.filepath)
-        db.session.delete(audio)
-        db.session.commit()
+        with audio_store.lock:
+            db.session.delete(audio)
+            db.session.commit()
+            # the stored file goes with the last row that references it; the
+            # same bytes under another extension are a different file
+            if not Audio.query.filter_by(filepath=audio.filepath).count():
+                audio_store.remove(audio.filepath)
         return "", 204
 
 
 class AudioListRes(Resource):
-    @marshal_with(audio_fields)
     def get(self):
-        audios = Audio.query.all()
-        return audios, 200
+        return list_resource(Audio, audio_fields, filters={"category_id": (Audio.category_id, int)})
 
     @marshal_with(audio_fields)
     def post(self):
@@ -88,14 +93,47 @@ class AudioListRes(Resource):
             abort(400, message={"file": "audio file required"})
         file = args["file"]
         name = secure_filename(file.filename)
-        filepath = os.path.join(app.config['AUDIOS_FOLDER'], name)
-        file.save(filepath)
-        audio = Audio(
-            name=name,
-            filepath=filepath,
-            content=args["content"],
-            category=category
-        )
-        db.session.add(audio)
-        db.session.commit()
+        extension = name.rsplit(".", 1)[-1].lower()
+        # stored by content, an identical upload reuses the file and its pcm
+        digest, tmp_path = audio_store.stage(file.stream)
+        with audio_store.lock:
+            filepath, created = audio_store.place(digest, tmp_path, extension)
+            if created:
+                # decode once to the playback format, stored next to the original
+                try:
+                    audio_ingest.ingest(filepath)
+                except Exception as exc:
+                    app.logger.error(exc)
+                    audio_store.remove(filepath)
+                    abort(400, message={"file": "audio file could not be decoded"})
+            audio = Audio(
+                name=name,
+                filepath=filepath,
+                content_hash=digest,
+                content=args["content"],
+                category=category
+            )
+            db.session.add(audio)
+            db.session.commit()
         return audio, 201
+
+
+class AudioFileRes(Resource):
+    # the stored clip, with ranges and conditional requests, the etag is the
+    # content hash so it stays valid across renames and duplicate uploads
+    def get(self, audio_id: int):
+        audio = db.session.query(Audio.filepath, Audio.content_hash).filter_by(id=audio_id).first()
+        if not audio or not os.path.exists(audio.filepath):
+            abort(404, message="audio not found")
+        size = os.path.getsize(audio.filepath)
+        # file_wrapper lets the server use sendfile, USE_X_SENDFILE hands it to the proxy
+        rv = send_file(audio.filepath, add_etags=False, conditional=False)
+        if audio.content_hash:
+            rv.set_etag(audio.content_hash)
+        else:
+            rv.set_etag("{}-{}".format(int(os.path.getmtime(audio.filepath)), size), weak=True)
+        if app.use_x_sendfile:
+            # ranges are served by the proxy along with the file
+            return rv.make_conditional(request)
+        rv.headers["Accept-Ranges"] = "bytes"
+        return rv.make_conditional(request, accept_ranges=True, complete_length=size)
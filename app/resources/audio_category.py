@@ -4,6 +4,7 @@ from flask_restful import Resource, abort, fields, marshal_with, reqparse
 
 from app import app, db
 from app.models import AudioCategory
+from app.resources.listing import list_resource
 
 audio_category_fields = {
     "id": fields.Integer,
@@ -45,10 +46,8 @@ class AudioCategoryRes(Resource):
 
 
 class AudioCategoryListRes(Resource):
-    @marshal_with(audio_category_fields)
     def get(self):
-        audio_categories = AudioCategory.query.all()
-        return audio_categories, 200
+        return list_resource(AudioCategory, audio_category_fields)
 
     @marshal_with(audio_category_fields)
     def post(self):
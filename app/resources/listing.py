@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+from flask import request
+from flask_restful import abort, marshal, inputs
+from sqlalchemy import and_, or_
+
+from app import app, db
+
+
+def parse_datetime(value, name):
+    try:
+        return inputs.datetime_from_iso8601(value)
+    except ValueError:
+        abort(400, message={name: "invalid datetime, use ISO 8601"})
+
+
+# a page of rows marshalled straight from a column query, no ORM instances
+#   fields=a,b        only these fields (depends maps a field to the columns it needs)
+#   limit, cursor     keyset pages on id, or on (modified, id) with order=modified,
+#                     the next cursor goes in the X-Next-Cursor header
+#   modified_since    and every arg in filters ({arg: (column, type)})
+def list_resource(model, resource_fields, depends=None, filters=None):
+    depends = depends or {}
+    filters = filters or {}
+    args = request.args
+
+    names = list(resource_fields)
+    if args.get("fields"):
+        names = [name.strip() for name in args["fields"].split(",") if name.strip()]
+        unknown = [name for name in names if name not in resource_fields]
+        if unknown:
+            abort(400, message={"fields": "unknown fields: {}".format(", ".join(unknown))})
+
+    order = args.get("order", "id")
+    if order not in ("id", "modified") or not hasattr(model, order):
+        abort(400, message={"order": "invalid order"})
+
+    limit = args.get("limit", type=int)
+    if limit is not None:
+        if limit < 1:
+            abort(400, message={"limit": "limit must be positive"})
+        limit = min(limit, app.config["API_MAX_PAGE_SIZE"])
+
+    # only the columns the requested fields need, plus the keyset columns
+    column_names = ["id"] + (["modified"] if order == "modified" else [])
+    for name in names:
+        for column_name in depends.get(name, [name]):
+            if column_name not in column_names:
+                column_names.append(column_name)
+    query = db.session.query(*[getattr(model, name) for name in column_names])
+
+    for arg, (column, arg_type) in filters.items():
+        value = args.get(arg, type=arg_type)
+        if value is not None:
+            query = query.filter(column == value)
+    if args.get("modified_since") and hasattr(model, "modified"):
+        query = query.filter(model.modified > parse_datetime(args["modified_since"], "modified_since"))
+
+    cursor = args.get("cursor")
+    if order == "modified":
+        if cursor:
+            modified, _, last_id = cursor.rpartition(",")
+            if not last_id.isdigit():
+                abort(400, message={"cursor": "invalid cursor"})
+            modified = parse_datetime(modified, "cursor")
+            query = query.filter(or_(model.modified > modified,
+                                     and_(model.modified == modified, model.id > int(last_id))))
+        query = query.order_by(model.modified, model.id)
+    else:
+        if cursor:
+            if not cursor.isdigit():
+                abort(400, message={"cursor": "invalid cursor"})
+            query = query.filter(model.id > int(cursor))
+        query = query.order_by(model.id)
+
+    if limit is not None:
+        query = query.limit(limit + 1)
+    rows = query.all()
+
+    headers = {}
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if order == "modified":
+            headers["X-Next-Cursor"] = "{},{}".format(last.modified.isoformat(), last.id)
+        else:
+            headers["X-Next-Cursor"] = str(last.id)
+
+    items = [SimpleNamespace(**row._asdict()) for row in rows]
+    return marshal(items, {name: resource_fields[name] for name in names}), 200, headers
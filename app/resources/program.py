@@ -2,34 +2,82 @@ import datetime
 import json
 import os
 import uuid
+import threading
+from collections import OrderedDict
 
+from flask import request
 from flask_restful import Resource, abort, fields, marshal_with, reqparse
 
 from app import app, db
 from app.models import Program
+from app.fsm_parser import JsonFsm, InvalidProgram, program_cache
+from app.resources.listing import list_resource
+
+
+class ProgramContents(object):
+    # diagram text as stored on disk, keyed by (id, modified) and returned
+    # without a json parse/dump round trip
+
+    def __init__(self, size=256):
+        self.size = size
+        self.contents = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, program):
+        key = (program.id, program.modified)
+        with self.lock:
+            content = self.contents.get(key)
+            if content is not None:
+                self.contents.move_to_end(key)
+                return content
+        with open(program.filepath) as f:
+            content = f.read()
+        self.put(program, content)
+        return content
+
+    def put(self, program, content):
+        with self.lock:
+            for key in [k for k in self.contents if k[0] == program.id]:
+                del self.contents[key]
+            self.contents[(program.id, program.modified)] = content
+            while len(self.contents) > self.size:
+                self.contents.popitem(last=False)
+
+    def discard(self, program_id):
+        with self.lock:
+            for key in [k for k in self.contents if k[0] == program_id]:
+                del self.contents[key]
+
+
+program_contents = ProgramContents(app.config['PROGRAM_CONTENT_CACHE_SIZE'])
 
 
 class ProgramJson(fields.Raw):
-    def format(self, filepath: str):
-        content = {}
-        with open(filepath) as f:
-            content = json.load(f)
-        return json.dumps(content)
+    def format(self, program: Program):
+        return program_contents.get(program)
 
-program_fields = {
+program_meta_fields = {
     "id": fields.Integer,
     "name": fields.String,
     "description": fields.String,
-    "content": ProgramJson(attribute="filepath"),
     "modified": fields.DateTime
 }
 
+program_fields = dict(program_meta_fields, content=ProgramJson(attribute=lambda program: program))
+
 program_parser = reqparse.RequestParser(bundle_errors=True)
 program_parser.add_argument("name", required=True, help="Invalid name")
 program_parser.add_argument("description", required=True, help="Invalid description")
 program_parser.add_argument("content", type=json.loads, required=True, help="Invalid content")
 
 
+def compile_program(content):
+    try:
+        return JsonFsm().compile(content)
+    except InvalidProgram as exc:
+        abort(400, message={"content": "Invalid program: {}".format(exc)})
+
+
 class ProgramRes(Resource):
     def check_program(self, program):
         if not program:
@@ -46,12 +94,17 @@ class ProgramRes(Resource):
         args = program_parser.parse_args()
         program = Program.query.filter_by(id=program_id).first()
         self.check_program(program)
+        fsm_dic = compile_program(args["content"])
         program.name = args["name"]
         program.description = args["description"]
+        content = json.dumps(args["content"])
         with open(program.filepath, "w") as f:
-            json.dump(args["content"], f)
+            f.write(content)
+        JsonFsm.saveCompiled(program.filepath, fsm_dic)
+        program_cache.discard(program.id)
         program.modified = datetime.datetime.now()
         db.session.commit()
+        program_contents.put(program, content)
         return program, 201
 
     def delete(self, program_id: int):
@@ -59,24 +112,31 @@ class ProgramRes(Resource):
         self.check_program(program)
         if os.path.exists(program.filepath):
             os.remove(program.filepath)
+        JsonFsm.removeCompiled(program.filepath)
+        program_cache.discard(program.id)
+        program_contents.discard(program.id)
         db.session.delete(program)
         db.session.commit()
         return "", 204
 
 
 class ProgramListRes(Resource):
-    @marshal_with(program_fields)
     def get(self):
-        programs = Program.query.all()
-        return programs, 200
+        # meta=true skips the diagrams, for program pickers
+        if request.args.get("meta", "").lower() in ("1", "true"):
+            return list_resource(Program, program_meta_fields)
+        return list_resource(Program, program_fields, depends={"content": ["id", "modified", "filepath"]})
 
     @marshal_with(program_fields)
     def post(self):
         args = program_parser.parse_args()
+        fsm_dic = compile_program(args["content"])
         name = ".".join([uuid.uuid4().hex, datetime.date.today().isoformat(), "json"])
         filepath = os.path.join(app.config['PROGRAMS_FOLDER'], name)
+        content = json.dumps(args["content"])
         with open(filepath, "w") as f:
-            json.dump(args["content"], f)
+            f.write(content)
+        JsonFsm.saveCompiled(filepath, fsm_dic)
         program = Program(
             filepath=filepath,
             name=args["name"],
@@ -84,4 +144,5 @@ class ProgramListRes(Resource):
         )
         db.session.add(program)
         db.session.commit()
+        program_contents.put(program, content)
         return program, 201
@@ -1,10 +1,13 @@
 import os
+import audioop
 import pyaudio
 from playsound import playsound
 import wave
+from contextlib import closing
 from Adafruit_PCA9685 import PCA9685
 import pyttsx3
 import time
+import threading
 
 import math
 
@@ -14,9 +17,16 @@ import speech_recognition as sr
 from google.cloud import texttospeech
 from playsound import playsound
 
+from app.vad import EnergyVad
+from app import audio_ingest, metrics
+
+# pyttsx3.init() hands every caller the same engine and its run loop can't
+# be entered twice, voices of different sessions take turns on it
+local_tts_lock = threading.Lock()
+
 class ServoDriver(PCA9685):
-    def __init__(self, freq=50, min_us=544, max_us=2400):
-        super().__init__()
+    def __init__(self, freq=50, min_us=544, max_us=2400, address=0x40, busnum=None):
+        super().__init__(address=address, busnum=busnum)
 
         self.FREQ = freq
         self.MIN_US = min_us
@@ -45,6 +55,10 @@ class ServoDriver(PCA9685):
         ticks = math.ceil(ticks - 0.5)
         return ticks
 
+class MicrophoneError(IOError):
+    pass
+
+
 class Voice(object):
     def play(self, filepath):
         raise NotImplementedError
@@ -92,43 +106,76 @@ class TestVoice(Voice):
     CHANNELS = 1
     RATE = 44100
     CHUNK = 1024
-    FILE_NAME = 'aux.wav'
 
     # recognition
     MODELDIR = "es-ES"
     GRAMMARDIR = "gram"
+    DECODER_RATE = 16000
+    STREAM_CHUNK = 512
 
     # text to speech
     RATE = 150
     VOLUME = 0.9
+    TTS_VOICE = 'spanish-latin-am'
 
-    def __init__(self, file_name='aux.wav', raspi=False, local=True):
+    def __init__(self, file_name=None, raspi=False, local=True, warm=True, input_device=None, output_device=None):
 
         ## load environment
 
-        self.FILE_NAME = file_name
         self.audio = pyaudio.PyAudio()
         self.raspi = raspi
 
         self.local = local
+        # decode while capturing, ended by the energy vad
+        self.streaming = True
+        # monotonic time the vad saw the end of the last utterance
+        self.speech_ended = None
+        # pyaudio device indexes, None for the system default
+        self.input_device = input_device if input_device is not None else (2 if raspi else None)
+        self.output_device = output_device
+        self.capture_rate = self.DECODER_RATE
+        # optional wav sink for listen(), for debugging only
+        self.debug_file = file_name
+        self.tts = None
+        self.tts_client = None
+        # TtsCache shared by both engines, set by VoiceEngine
+        self.tts_cache = None
+        # playback.Player with one long lived output stream, set by VoiceEngine
+        self.player = None
+
+        self.decoder = None
+        # names of the jsgf searches already registered in the decoder
+        self.searches = set()
+        self.r = sr.Recognizer()
+
+        # VoiceEngine builds the heavy parts itself, in parallel
+        if warm:
+            self.initDecoder()
+            self.calibrate()
+            self.initTts(self.local)
 
+    def initDecoder(self):
         self.config = Decoder.default_config()
         self.config.set_string('-hmm', os.path.join(self.MODELDIR, 'acoustic-model'))
         self.config.set_string('-dict', os.path.join(self.MODELDIR, 'pronounciation-dictionary.dict'))
         self.config.set_string('-logfn', os.devnull)
         self.decoder = Decoder(self.config)
-        self.r = sr.Recognizer()
+        self.searches.clear()
+
+    def calibrate(self, duration=1):
         print("adjunting...")
-        with sr.Microphone() as source:
-            self.r.adjust_for_ambient_noise(source)
-
-        # tts
-        if self.local:
-            self.tts = pyttsx3.init()
-            self.tts.setProperty('rate', self.RATE)
-            self.tts.setProperty('volume', self.VOLUME)
-            self.tts.setProperty('voice', 'spanish-latin-am')
-        else:
+        with sr.Microphone(device_index=self.input_device) as source:
+            self.r.adjust_for_ambient_noise(source, duration=duration)
+        return self.r.energy_threshold
+
+    def initTts(self, local):
+        if local and self.tts is None:
+            with local_tts_lock:
+                self.tts = pyttsx3.init()
+                self.tts.setProperty('rate', self.RATE)
+                self.tts.setProperty('volume', self.VOLUME)
+                self.tts.setProperty('voice', self.TTS_VOICE)
+        elif not local and self.tts_client is None:
         # Instantiates a client
             self.tts_client = texttospeech.TextToSpeechClient()
             # Build the voice request, select the language code ("en-US") and the ssml
@@ -137,102 +184,168 @@ class TestVoice(Voice):
                 language_code='es-ES',
                 ssml_gender=texttospeech.enums.SsmlVoiceGender.FEMALE)
 
-            # Select the type of audio file you want returned
+            # Select the type of audio file you want returned, wav already in
+            # the playback format
             self.tts_audio_config = texttospeech.types.AudioConfig(
-                audio_encoding=texttospeech.enums.AudioEncoding.MP3)
-        
+                audio_encoding=texttospeech.enums.AudioEncoding.LINEAR16,
+                sample_rate_hertz=audio_ingest.PLAYBACK_RATE)
+
+    def setLocal(self, local):
+        # choose the tts engine for the next run
+        self.initTts(local)
+        self.local = local
 
     def speak(self, phrase):
         print('decir: ' + phrase)
-        if self.local:
-            self.tts.say(phrase)
-            self.tts.runAndWait()
+        if self.tts_cache is not None:
+            # repeated phrases play straight from disk
+            if self.local:
+                filename = self.tts_cache.get(phrase, self.TTS_VOICE, 'pyttsx3',
+                                              {'rate': self.RATE, 'volume': self.VOLUME,
+                                               'playback_rate': audio_ingest.PLAYBACK_RATE},
+                                              self.synthesizeLocal, 'pcm.wav')
+            else:
+                filename = self.tts_cache.get(phrase, 'es-ES/FEMALE', 'google',
+                                              {'encoding': 'LINEAR16', 'playback_rate': audio_ingest.PLAYBACK_RATE},
+                                              self.synthesizeCloud, 'pcm.wav')
+            self.play(filename)
+        elif self.local:
+            with local_tts_lock:
+                self.tts.say(phrase)
+                self.tts.runAndWait()
         else:
-            # Set the text input to be synthesized
-            synthesis_input = texttospeech.types.SynthesisInput(text=phrase)
-            # Perform the text-to-speech request on the text input with the selected
-            # voice parameters and audio file type
-            response = self.tts_client.synthesize_speech(synthesis_input, self.tts_voice, self.tts_audio_config)
-            audio_file='tts.mp3'
-            # The response's audio_content is binary.
-            with open(audio_file, 'wb') as out:
-                out.write(response.audio_content)
+            audio_file='tts.wav'
+            self.synthesizeCloud(phrase, audio_file)
             print('reproducir voz sintetica')
-            command = '/usr/bin/mpg321 ' + audio_file
-            print(command)
-            os.system(command)
+            self.play(audio_file)
+
+    @metrics.SYNTHESIS_SECONDS.labels('pyttsx3').time()
+    def synthesizeLocal(self, phrase, filename):
+        raw_file = filename + '.raw.wav'
+        try:
+            with local_tts_lock:
+                self.tts.save_to_file(phrase, raw_file)
+                self.tts.runAndWait()
+            audio_ingest.normalise(raw_file, filename)
+        finally:
+            if os.path.exists(raw_file):
+                os.remove(raw_file)
+
+    @metrics.SYNTHESIS_SECONDS.labels('google').time()
+    def synthesizeCloud(self, phrase, filename):
+        # Set the text input to be synthesized
+        synthesis_input = texttospeech.types.SynthesisInput(text=phrase)
+        # Perform the text-to-speech request on the text input with the selected
+        # voice parameters and audio file type
+        response = self.tts_client.synthesize_speech(synthesis_input, self.tts_voice, self.tts_audio_config)
+        # The response's audio_content is binary.
+        with open(filename, 'wb') as out:
+            out.write(response.audio_content)
 
     def play(self, filename):
         print('reproduciendo archivo: ' + filename)
-        extension = filename.split('.')[-1]
-        if extension == 'wav':
-            wf = wave.open(filename, 'rb')
-            stream = self.audio.open(format=self.audio.get_format_from_width(wf.getsampwidth()),
-                                    channels=wf.getnchannels(),
-                                    rate=wf.getframerate(),
-                                    output=True)
+        if self.player is not None:
+            self.player.play(audio_ingest.playable(filename))
+            return
+
+        # clips are decoded to the device format once, playback is a plain stream write
+        wf = wave.open(audio_ingest.playable(filename), 'rb')
+        stream = self.audio.open(format=self.audio.get_format_from_width(wf.getsampwidth()),
+                                channels=wf.getnchannels(),
+                                rate=wf.getframerate(),
+                                output=True,
+                                output_device_index=self.output_device)
+        data = wf.readframes(self.CHUNK)
+
+        # play
+        while len(data) > 0:
+            stream.write(data)
             data = wf.readframes(self.CHUNK)
+        stream.stop_stream()
+        stream.close()
+        wf.close()
 
-            # play
-            while len(data) > 0:
-                stream.write(data)
-                data = wf.readframes(self.CHUNK)
+    def listen(self, duration=3):
+        # capture into a preallocated buffer and hand 16 kHz pcm to the decoder,
+        # the wav dump only happens when debug_file is set
+        stream = self.openInput()
+        size = int(self.capture_rate * duration) * 2
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        pos = 0
+        try:
+            while pos < size:
+                data = stream.read(min(self.CHUNK, (size - pos) // 2), exception_on_overflow=False)
+                view[pos:pos + len(data)] = data
+                pos += len(data)
+        finally:
             stream.stop_stream()
             stream.close()
-        elif extension == 'mp3':
-            command = '/usr/bin/mpg321 ' + filename
-            print(command)
-            os.system(command)
 
-    def listen(self, duration=3):
-        # start recording
-        if self.raspi:
-            stream = self.audio.open(format=self.FORMAT,
-                                     channels=1,
-                                     rate=self.RATE,
-                                     input_device_index=2,
-                                     input=True,
-                                     frames_per_buffer=self.CHUNK)
-        else:
-            stream = self.audio.open(format=self.FORMAT,
-                                     channels=self.CHANNELS,
-                                     rate=self.RATE,
-                                     input_device_index = 7,
-                                     input=True,
-                                     frames_per_buffer=self.CHUNK)
-
-        frames = []
-
-        for i in range(0, int(self.RATE / self.CHUNK * duration)):
-            data = stream.read(self.CHUNK, exception_on_overflow=False)
-            frames.append(data)
-
-        stream.stop_stream()
-        stream.close()
+        raw_data = self.toDecoderRate(view[:pos])[0]
 
-        wave_file = wave.open(self.FILE_NAME, 'wb')
-        if self.raspi:
+        if self.debug_file:
+            wave_file = wave.open(self.debug_file, 'wb')
             wave_file.setnchannels(1)
-        else:
-            wave_file.setnchannels(self.CHANNELS)
-
-        wave_file.setsampwidth(self.audio.get_sample_size(self.FORMAT))
-        wave_file.setframerate(self.RATE)
-        wave_file.writeframes(b''.join(frames))
-        wave_file.close()
-
-        with sr.AudioFile(self.FILE_NAME) as source:
-            audio = self.r.record(source)
-
-        raw_data = audio.get_raw_data(convert_rate=16000, convert_width=2)
+            wave_file.setsampwidth(self.audio.get_sample_size(self.FORMAT))
+            wave_file.setframerate(self.DECODER_RATE)
+            wave_file.writeframes(raw_data)
+            wave_file.close()
 
         return raw_data
 
+    def openInput(self):
+        try:
+            return self.openInputAt(self.capture_rate)
+        except Exception:
+            if self.capture_rate != self.DECODER_RATE:
+                raise
+            # many usb microphones can't record at 16 kHz, capture at the
+            # device's own rate from now on and resample for the decoder
+            rate = int(self.inputDeviceInfo()['defaultSampleRate'])
+            if rate == self.DECODER_RATE:
+                raise
+            stream = self.openInputAt(rate)
+            print('capturando a {} Hz'.format(rate))
+            self.capture_rate = rate
+            return stream
+
+    def openInputAt(self, rate):
+        return self.audio.open(format=self.FORMAT,
+                               channels=1,
+                               rate=rate,
+                               input_device_index=self.input_device,
+                               input=True,
+                               frames_per_buffer=self.CHUNK)
+
+    def inputDeviceInfo(self):
+        if self.input_device is None:
+            return self.audio.get_default_input_device_info()
+        return self.audio.get_device_info_by_index(self.input_device)
+
+    def toDecoderRate(self, data, state=None):
+        # devices that can't record at 16 kHz are resampled in one C pass
+        if self.capture_rate == self.DECODER_RATE:
+            return bytes(data), state
+        return audioop.ratecv(data, 2, 1, self.capture_rate, self.DECODER_RATE, state)
+
     def echo(self):
-        self.play(self.FILE_NAME)
+        if self.debug_file:
+            self.play(self.debug_file)
 
     def recognize(self):
-        with sr.Microphone() as source:
+        if self.streaming:
+            # a decoder error is no answer, a microphone error fails the run
+            # instead of turning every retry into a busy loop
+            try:
+                with closing(self.micChunks()) as chunks:
+                    return self.recognizeStream(chunks)
+            except MicrophoneError:
+                raise
+            except Exception:
+                return None
+
+        with sr.Microphone(device_index=self.input_device) as source:
             audio = self.r.listen(source)
 
 
@@ -247,6 +360,78 @@ class TestVoice(Voice):
         except Exception:
             return None
 
+    def recognizeStream(self, chunks):
+        # feed 16 kHz mono chunks to the decoder as they arrive, the hypothesis
+        # is ready a few frames after the vad sees the end of speech
+        vad = EnergyVad(sample_rate=self.DECODER_RATE, noise_floor=self.r.energy_threshold / 3.0, ratio=3.0)
+        self.decoder.start_utt()
+        self.speech_ended = None
+        try:
+            for chunk in chunks:
+                self.decoder.process_raw(chunk, False, False)
+                if vad.feed(chunk) == EnergyVad.END:
+                    self.speech_ended = time.monotonic()
+                    break
+        finally:
+            self.decoder.end_utt()
+
+        hyp = self.decoder.hyp()
+        if self.speech_ended is not None:
+            # what the user waits for after speaking, before the fsm reacts
+            metrics.DECODE_TAIL_SECONDS.observe(time.monotonic() - self.speech_ended)
+        if hyp is None or not vad.heard_speech:
+            return None
+        return hyp.hypstr
+
+    def recognizeWav(self, filename):
+        # same path as the microphone, for recorded fixtures
+        with closing(self.wavChunks(filename)) as chunks:
+            return self.recognizeStream(chunks)
+
+    def micChunks(self):
+        try:
+            stream = self.openInput()
+        except Exception as exc:
+            raise MicrophoneError('can not open input device {}: {}'.format(self.input_device, exc)) from exc
+        state = None
+        chunk = self.STREAM_CHUNK * self.capture_rate // self.DECODER_RATE
+        try:
+            while True:
+                try:
+                    data = stream.read(chunk, exception_on_overflow=False)
+                except Exception as exc:
+                    raise MicrophoneError('input device {}: {}'.format(self.input_device, exc)) from exc
+                data, state = self.toDecoderRate(data, state)
+                yield data
+        finally:
+            stream.stop_stream()
+            stream.close()
+
+    @classmethod
+    def wavChunks(cls, filename):
+        # chunks converted to 16 bit mono at the decoder rate
+        wf = wave.open(filename, 'rb')
+        width = wf.getsampwidth()
+        channels = wf.getnchannels()
+        rate = wf.getframerate()
+        state = None
+        try:
+            data = wf.readframes(cls.STREAM_CHUNK)
+            while len(data) > 0:
+                if width == 1:
+                    # 8 bit wav samples are unsigned
+                    data = audioop.bias(data, 1, -128)
+                if width != 2:
+                    data = audioop.lin2lin(data, width, 2)
+                if channels == 2:
+                    data = audioop.tomono(data, 2, 0.5, 0.5)
+                if rate != cls.DECODER_RATE:
+                    data, state = audioop.ratecv(data, 2, 1, rate, cls.DECODER_RATE, state)
+                yield data
+                data = wf.readframes(cls.STREAM_CHUNK)
+        finally:
+            wf.close()
+
     def loadGrammar(self, grammar):
         # delete(self.decoder)
         grammar_file = grammar + '.gram'
@@ -256,16 +441,29 @@ class TestVoice(Voice):
         self.config.set_string('-jsgf', c_string)
 
         self.decoder.reinit(self.config)
+        self.searches.clear()
+
+    def addGrammar(self, name, jsgf):
+        # register a jsgf grammar as a named search, only once per decoder
+        if name not in self.searches:
+            self.decoder.set_jsgf_string(name, jsgf)
+            self.searches.add(name)
+
+    def useGrammar(self, name):
+        # switching searches needs no file access nor reinit
+        self.decoder.set_search(name)
 
     def close(self):
+        if self.player is not None:
+            self.player.close()
         self.audio.terminate()
 
 class CholitaTraction(Traction):
 
-    def __init__(self, left=1, right=2):
+    def __init__(self, left=1, right=2, address=0x40, busnum=None):
         self.left_motor = left
         self.right_motor = right
-        self.driver = ServoDriver()
+        self.driver = ServoDriver(address=address, busnum=busnum)
 
         self.move_dic = {
             'adelante': self.forward,
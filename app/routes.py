@@ -1,29 +1,38 @@
 import os
 import json
-from threading import Thread
 
-from datetime import datetime
 from flask import render_template, flash, redirect, url_for, request
 from flask import jsonify, abort, make_response
 from flask_login import login_user, logout_user, current_user, login_required
+from flask_restful import fields
+from sqlalchemy import true
 from werkzeug.urls import url_parse
 from werkzeug.utils import secure_filename
 from app import app, db
 from app.forms import LoginForm, RegistrationForm, EditProfileForm
 from app.models import User, Audio, Program, Word, Action, AudioCategory
-from app.fsm_parser import JsonFsm, Robot
+from app.fsm_parser import InvalidProgram
+from app.runner import run_executor
+from app.sessions import session_manager, DEFAULT_SESSION, InvalidBinding, DeviceBusy
+from app.tracing import trace_store
+from app.voice import voice_engine
+from app.word_index import word_index
+from app.resources.listing import list_resource
+from app.activity import last_seen, user_cache
 
 ALLOWED_EXTENSIONS = {'wav', 'mp3'}
 
-fsm = JsonFsm()
-running_instance = Robot({})
+action_fields = {
+    'id': fields.Integer,
+    'category': fields.String,
+    'action': fields.String
+}
 
 
 @app.before_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        last_seen.touch(current_user.id)
 
 
 @app.route('/')
@@ -98,9 +107,12 @@ def user(username):
 def edit_profile():
     form = EditProfileForm(current_user.username)
     if form.validate_on_submit():
-        current_user.username = form.username.data
-        current_user.about_me = form.about_me.data
+        # current_user is a cached detached copy, edit the row itself
+        user = User.query.get(current_user.id)
+        user.username = form.username.data
+        user.about_me = form.about_me.data
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash('Your changes have been saved.')
         return redirect(url_for('edit_profile'))
     elif request.method == 'GET':
@@ -112,8 +124,6 @@ def edit_profile():
 
 @app.route('/api/programs/<int:program_id>/run', methods=['GET'])
 def run_program(program_id):
-    global fsm
-    global running_instance
     is_local = request.args.get('proc') == 'offline'
     if is_local:
         print('offline processing')
@@ -124,45 +134,90 @@ def run_program(program_id):
 
     print('corriendo {}'.format(program.name))
 
-    active_programs = Program.query.filter_by(active=True).first()
+    # true() renders a literal 1, which the partial ix_program_active matches
+    active_programs = Program.query.filter(Program.active == true()).first()
 
     if active_programs:
         active_id = active_programs.id
 
-        if running_instance.isRunning():
+        if run_executor.current():
             return jsonify({'result': 'a program is already running', 'id': active_id}), 403
         else:
-            old_program = Program.query.filter_by(id=program_id).first()
-            old_program.active = False
-    # fsm = 0
+            active_programs.active = False
+
+    # marked before the job is handed over, the worker clears it when the
+    # run ends, however fast that is
+    program.active = True
+    db.session.commit()
+
+    # the single robot endpoints drive the default session
+    return_data, code = start_run(session_manager.default, program, is_local)
+    if not return_data["success"]:
+        program.active = False
+        db.session.commit()
+
+    return jsonify(return_data), code
+
 
-    # db.session.commit()
+def start_run(session, program, is_local):
     return_data = {"success": False}
     code = 500
     try:
-        program.active = True
-        db.session.commit()
-        running_instance = fsm.loadFSM(program.filepath, local=is_local)
-        running_instance.begin()
-        program.active = False
-        db.session.commit()
-        return_data["success"] = True
-        code = 200
+        job = session.run(program, local=is_local)
+        if job:
+            return_data["success"] = True
+            return_data["job"] = job.id
+            code = 202
+        else:
+            return_data["error"] = "run queue is full"
+            code = 503
+    except InvalidProgram as exc:
+        return_data["error"] = str(exc)
+        code = 400
     except Exception as exc:
         return_data["error"] = str(exc)
         app.logger.error(exc)
-        program.active = False
-        db.session.commit()
 
-    return jsonify(return_data), code
+    return return_data, code
+
+
+@app.route('/api/runs/<string:job_id>', methods=['GET'])
+def get_run(job_id):
+    job = session_manager.job(job_id)
+
+    if not job:
+        return jsonify({'result': 'no run'}), 404
+
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/runs/<string:job_id>/trace', methods=['GET'])
+def get_run_trace(job_id):
+    # min_ms keeps only the spans at least that long, to find the slow turns
+    min_ms = request.args.get('min_ms', type=float)
+    job = session_manager.job(job_id)
+
+    if job and job.robot and job.robot.trace is not None:
+        return jsonify(job.robot.trace.to_dict(min_ms))
+
+    trace = trace_store.get(job_id)
+    if not trace:
+        return jsonify({'result': 'no trace'}), 404
+    if min_ms is not None:
+        trace['events'] = [event for event in trace['events'] if event[3] is not None and event[3] >= min_ms]
+    return jsonify(trace)
+
+
+@app.route('/api/voice/ready', methods=['GET'])
+def voice_ready():
+    status = voice_engine.status()
+    return jsonify(status), 200 if status['ready'] else 503
 
 
 @app.route('/api/programs/stop', methods=['GET'])
 def stop_program():
-    # global fsm
-    global running_instance
     print('deteniendo')
-    program = Program.query.filter_by(active=True).first()
+    program = Program.query.filter(Program.active == true()).first()
 
     if not program:
         return jsonify({'result': 'no program running'}), 404
@@ -170,34 +225,117 @@ def stop_program():
         program.active = False
         db.session.commit()
 
-        try:
-            running_instance.trigger('kill')
-            return jsonify({'result': 'program stopped'}), 200
-        except:
+        job = session_manager.default.stop()
+        if job:
+            return jsonify({'result': 'program stopped', 'job': job.id}), 200
+        else:
             return jsonify({'result': 'not stopped'}), 404
 
 
+# sessions, one robot each with its own devices and runs
+
+@app.route('/api/sessions', methods=['GET'])
+def get_sessions():
+    return jsonify([session.to_dict() for session in session_manager.all()])
+
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    # json binding, see sessions.parse_binding
+    try:
+        session = session_manager.create(request.get_json(silent=True) or {})
+    except InvalidBinding as exc:
+        return jsonify({'result': str(exc)}), 400
+    except DeviceBusy as exc:
+        return jsonify({'result': str(exc)}), 409
+
+    if not session:
+        return jsonify({'result': 'too many sessions'}), 503
+
+    return jsonify(session.to_dict()), 201
+
+
+@app.route('/api/sessions/<string:session_id>', methods=['GET'])
+def get_session(session_id):
+    session = session_manager.get(session_id)
+
+    if not session:
+        return jsonify({'result': 'no session'}), 404
+
+    return jsonify(session.to_dict())
+
+
+@app.route('/api/sessions/<string:session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    session = session_manager.get(session_id)
+
+    if not session:
+        return jsonify({'result': 'no session'}), 404
+    if session.id == DEFAULT_SESSION:
+        return jsonify({'result': 'the default session can not be removed'}), 403
+    if session.isRunning():
+        return jsonify({'result': 'session is running', 'job': session.executor.current().id}), 409
+
+    session_manager.remove(session_id)
+    return jsonify({'result': True})
+
+
+@app.route('/api/sessions/<string:session_id>/programs/<int:program_id>/run', methods=['GET'])
+def run_session_program(session_id, program_id):
+    session = session_manager.get(session_id)
+    if not session:
+        return jsonify({'result': 'no session'}), 404
+
+    program = Program.query.filter_by(id=program_id).first()
+    if not program:
+        return jsonify({'result': 'no file'}), 404
+
+    # Program.active belongs to the single robot endpoints
+    if session.id == DEFAULT_SESSION:
+        return run_program(program_id)
+
+    return_data, code = start_run(session, program, request.args.get('proc') == 'offline')
+    return jsonify(return_data), code
+
+
+@app.route('/api/sessions/<string:session_id>/stop', methods=['GET'])
+def stop_session(session_id):
+    session = session_manager.get(session_id)
+    if not session:
+        return jsonify({'result': 'no session'}), 404
+
+    if session.id == DEFAULT_SESSION:
+        return stop_program()
+
+    job = session.stop()
+    if not job:
+        return jsonify({'result': 'no program running'}), 404
+
+    return jsonify({'result': 'program stopped', 'job': job.id}), 200
+
+
 @app.route('/api/words', methods=['GET'])
 def get_words():
-    words = Word.query.all()
-    words_list = [w.word for w in words]
+    # the whole dictionary is served pre-serialised, clients revalidate with the etag
+    word_index.refresh()
+    response = make_response(word_index.body)
+    response.mimetype = 'application/json'
+    response.set_etag(word_index.etag)
+    response.cache_control.no_cache = True
 
-    return jsonify(words_list), 200
+    return response.make_conditional(request)
 
 
 @app.route('/api/words/<string:hint>', methods=['GET'])
 def get_candidates(hint):
-    candidates = Word.query.filter(Word.word.like(hint + '%'))
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if (limit is not None and limit < 0) or offset < 0:
+        return jsonify({'result': 'invalid limit or offset'}), 400
 
-    candidates_list = []
+    word_index.refresh()
+    candidates_list = word_index.prefix(hint, limit, offset)
 
-    for candidate in candidates:
-        candidates_list.append(candidate.word)
-    #
-    # if not candidates:
-    #     return jsonify({'result': 'no file'}), 404
-    #
-    # audio_dic = {'id': audio.id, 'name': audio.name, 'content': audio.content}
     return jsonify(candidates_list)
 
 
@@ -205,20 +343,11 @@ def get_candidates(hint):
 
 @app.route('/api/actions', methods=['GET'])
 def get_actions():
-    # fetch all audios and return a list
-    actions = Action.query.all()
-
-    actions_list = []
-
-    for action in actions:
-        actions_list.append({
-            'id': action.id,
-            'category': action.category,
-            'action': action.action
-        })
-        # audios_dic[audio.id] = audio.filepath
+    # same paging, projection and filters as the rest resources
+    actions_list, code, headers = list_resource(Action, action_fields,
+                                                filters={'category': (Action.category, str)})
 
-    return jsonify(actions_list)
+    return jsonify(actions_list), code, headers
 
 
 @app.route('/api/actions/<int:action_id>', methods=['GET'])
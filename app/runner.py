@@ -0,0 +1,127 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, db, metrics
+from app.tracing import RunTrace, trace_store
+from app.models import Program
+
+
+class RunJob(object):
+    def __init__(self, program_id, robot, session_id=None):
+        self.id = uuid.uuid4().hex
+        self.program_id = program_id
+        self.robot = robot
+        self.session_id = session_id
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def isDone(self):
+        return self.status in ('finished', 'failed')
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.time()
+        return end - self.started
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'program_id': self.program_id,
+            'session_id': self.session_id,
+            'status': self.status,
+            'state': self.robot.state if self.robot else None,
+            'elapsed': round(self.elapsed(), 3),
+            'result': self.result,
+            'error': self.error
+        }
+
+
+class RunExecutor(object):
+    # runs robots in a bounded pool so the http workers stay free; only the
+    # default session keeps Program.active, other sessions track their own runs
+
+    def __init__(self, workers=1, max_pending=1, history=100, session_id=None, track_active=True):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.history = history
+        self.session_id = session_id
+        self.track_active = track_active
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, program_id, robot):
+        # returns None when the executor is full
+        with self.lock:
+            pending = [job for job in self.jobs.values() if not job.isDone()]
+            if len(pending) >= self.workers + self.max_pending:
+                return None
+            job = RunJob(program_id, robot, self.session_id)
+            self.jobs[job.id] = job
+            self.trim()
+        self.executor.submit(self.run, job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def current(self):
+        # oldest job that has not finished yet
+        with self.lock:
+            for job in self.jobs.values():
+                if not job.isDone():
+                    return job
+        return None
+
+    def last(self):
+        with self.lock:
+            return next(reversed(self.jobs.values()), None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def trim(self):
+        # forget the oldest finished jobs beyond the history size
+        done = [job_id for job_id, job in self.jobs.items() if job.isDone()]
+        for job_id in done[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def run(self, job):
+        job.status = 'running'
+        job.started = time.time()
+        trace = job.robot.trace = RunTrace(job.id, job.program_id, app.config['TRACE_MAX_EVENTS'])
+        with app.app_context():
+            try:
+                job.robot.open()
+                job.robot.begin()
+                job.result = 'stopped' if job.robot.is_oblivion() else 'completed'
+                job.status = 'finished'
+            except Exception as exc:
+                app.logger.error(exc)
+                job.error = str(exc)
+                job.status = 'failed'
+            finally:
+                job.robot.close()
+                job.finished = time.time()
+                metrics.RUNS.labels(job.result or job.status).inc()
+                metrics.RUN_SECONDS.observe(job.elapsed())
+                trace.finish(job.result or job.status, job.error)
+                trace_store.save(trace)
+                program = Program.query.filter_by(id=job.program_id).first() if self.track_active else None
+                if program:
+                    program.active = False
+                    db.session.commit()
+                db.session.remove()
+
+
+run_executor = RunExecutor(app.config['RUN_WORKERS'], app.config['RUN_QUEUE_SIZE'],
+                           app.config['RUN_HISTORY'], session_id='default')
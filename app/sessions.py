@@ -0,0 +1,242 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+from app import app
+from app.fsm_parser import Robot, JsonFsm, program_cache
+from app.robot import CholitaTraction
+from app.runner import RunExecutor, run_executor
+from app.simulator import SimulatedVoice, SimulatedTraction, choices, limit
+from app.voice import VoiceEngine, voice_engine
+
+DEFAULT_SESSION = 'default'
+TRACTION_ADDRESS = 0x40
+
+
+class InvalidBinding(ValueError):
+    pass
+
+
+class DeviceBusy(ValueError):
+    pass
+
+
+def optional_int(data, key):
+    value = data.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise InvalidBinding('{} must be an integer'.format(key))
+    return value
+
+
+def parse_binding(data):
+    # the devices of a session: 'devices' binds audio in/out by pyaudio index
+    # and optionally a traction board by i2c bus and address, 'simulated'
+    # answers from a script or the program grammars without hardware
+    if not isinstance(data, dict):
+        raise InvalidBinding('binding must be an object')
+    kind = data.get('binding', 'simulated')
+    if kind == 'devices':
+        traction = data.get('traction')
+        if traction is not None:
+            if not isinstance(traction, dict):
+                raise InvalidBinding('traction must be an object')
+            address = optional_int(traction, 'address')
+            traction = {'bus': optional_int(traction, 'bus'),
+                        'address': TRACTION_ADDRESS if address is None else address}
+        return {'binding': kind,
+                'input_device': optional_int(data, 'input_device'),
+                'output_device': optional_int(data, 'output_device'),
+                'traction': traction}
+    if kind == 'simulated':
+        answers = data.get('answers') or []
+        if not isinstance(answers, list) or not all(isinstance(answer, str) for answer in answers):
+            raise InvalidBinding('answers must be a list of strings')
+        policy = data.get('policy', 'random')
+        if policy not in ('random', 'first'):
+            raise InvalidBinding('policy must be random or first')
+        try:
+            delay = float(data.get('delay', 0.0))
+        except (TypeError, ValueError):
+            raise InvalidBinding('delay must be a number')
+        seed = optional_int(data, 'seed')
+        max_transitions = optional_int(data, 'max_transitions')
+        if delay < 0 or (max_transitions is not None and max_transitions < 1):
+            raise InvalidBinding('delay and max_transitions must be positive')
+        return {'binding': kind,
+                'answers': answers,
+                'policy': policy,
+                'seed': seed or 0,
+                'delay': delay,
+                'max_transitions': max_transitions or app.config['SESSION_MAX_TRANSITIONS']}
+    raise InvalidBinding('binding must be devices or simulated')
+
+
+def claims(binding):
+    # hardware held by a binding, two sessions can't share any of it
+    if binding['binding'] != 'devices':
+        return set()
+    result = {('input', binding['input_device']), ('output', binding['output_device'])}
+    if binding['traction'] is not None:
+        result.add(('traction', binding['traction']['bus'], binding['traction']['address']))
+    return result
+
+
+class Session(object):
+    # one robot: its devices, a single worker executor and its run history.
+    # device sessions own a VoiceEngine, simulated ones build their voice per run
+
+    def __init__(self, session_id, binding, engine=None, executor=None):
+        self.id = session_id
+        self.binding = binding
+        self.created = time.time()
+        self.engine = engine
+        self.traction = None
+        self.traction_lock = threading.Lock()
+        if self.engine is None and binding['binding'] == 'devices':
+            self.engine = VoiceEngine(app.config['RASPI'],
+                                      os.path.join(app.config['UPLOAD_FOLDER'],
+                                                   'voice_calibration_{}.json'.format(session_id)),
+                                      app.config['VOICE_RECALIBRATE_INTERVAL'],
+                                      voice_engine.voice.tts_cache, app.config['CLIP_CACHE_SIZE'],
+                                      input_device=binding['input_device'],
+                                      output_device=binding['output_device'])
+            self.engine.start()
+        self.executor = executor or RunExecutor(1, app.config['RUN_QUEUE_SIZE'], app.config['RUN_HISTORY'],
+                                                session_id=session_id, track_active=False)
+
+    def getTraction(self):
+        # the board is opened on the first run and kept for the session
+        config = self.binding.get('traction')
+        if config is None:
+            return None
+        with self.traction_lock:
+            if self.traction is None:
+                self.traction = CholitaTraction(address=config['address'], busnum=config['bus'])
+            return self.traction
+
+    def loadRobot(self, program, local=True):
+        fsm_dic = JsonFsm.resolve(program_cache.get(program))
+        fsm_dic['local_proc'] = local
+        if self.binding['binding'] == 'simulated':
+            voice = SimulatedVoice(self.binding['answers'], choices(fsm_dic), self.binding['policy'],
+                                   self.binding['seed'], self.binding['delay'])
+            return limit(Robot(fsm_dic, player=voice, traction=SimulatedTraction()),
+                         self.binding['max_transitions'])
+        traction = self.getTraction()
+        if traction is None and self.id != DEFAULT_SESSION:
+            # Robot would open the default board, which the default session holds
+            traction = SimulatedTraction()
+        return Robot(fsm_dic, self.engine, traction=traction)
+
+    def run(self, program, local=True):
+        # None when the session already has a run and a queued one
+        robot = self.loadRobot(program, local)
+        job = self.executor.submit(program.id, robot)
+        if job is None:
+            robot.close()
+        return job
+
+    def stop(self):
+        job = self.executor.current()
+        if job is not None:
+            job.robot.trigger('kill')
+        return job
+
+    def isRunning(self):
+        return self.executor.current() is not None
+
+    def close(self):
+        self.executor.shutdown()
+        if self.engine is not None and self.engine is not voice_engine:
+            self.engine.close()
+
+    def to_dict(self):
+        job = self.executor.current() or self.executor.last()
+        return {
+            'id': self.id,
+            'binding': self.binding,
+            'created': datetime.utcfromtimestamp(self.created).isoformat() + 'Z',
+            'running': self.isRunning(),
+            'job': job.to_dict() if job else None,
+            'voice': self.engine.status() if self.engine is not None else None,
+        }
+
+
+class SessionManager(object):
+    # the sessions of this process by id, the default one backs the
+    # single robot endpoints and can't be removed
+
+    def __init__(self, default, default_claims, max_sessions=8):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict([(default.id, default)])
+        self.claims = {default.id: default_claims}
+        self.lock = threading.Lock()
+
+    @property
+    def default(self):
+        return self.sessions[DEFAULT_SESSION]
+
+    def create(self, data):
+        # None when the process already hosts max_sessions
+        binding = parse_binding(data)
+        wanted = claims(binding)
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            if len(self.claims) >= self.max_sessions:
+                return None
+            for other_id, held in self.claims.items():
+                if wanted & held:
+                    raise DeviceBusy('devices already bound to session {}'.format(other_id))
+            # reserved before the engine is built, outside the lock
+            self.claims[session_id] = wanted
+        try:
+            session = Session(session_id, binding)
+        except Exception:
+            with self.lock:
+                del self.claims[session_id]
+            raise
+        with self.lock:
+            self.sessions[session_id] = session
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def all(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    def remove(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is not None:
+                del self.claims[session_id]
+        if session is not None:
+            session.close()
+        return session
+
+    def job(self, job_id):
+        for session in self.all():
+            job = session.executor.get(job_id)
+            if job is not None:
+                return job
+        return None
+
+
+def default_session():
+    binding = {'binding': 'devices', 'input_device': voice_engine.voice.input_device,
+               'output_device': voice_engine.voice.output_device, 'traction': None}
+    held = claims(binding)
+    if app.config['RASPI']:
+        # Robot opens the default board itself for the default session
+        held.add(('traction', None, TRACTION_ADDRESS))
+    return Session(DEFAULT_SESSION, binding, engine=voice_engine, executor=run_executor), held
+
+
+session_manager = SessionManager(*default_session(), max_sessions=app.config['MAX_SESSIONS'])
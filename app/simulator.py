@@ -0,0 +1,175 @@
+import json
+import time
+import random
+from collections import OrderedDict
+
+from app.fsm_parser import Robot, JsonFsm, program_cache
+
+
+class SimulatedVoice(object):
+    # TestVoice stand-in without audio: speak and play return at once,
+    # recognize() answers from the script first, then picks among the valid
+    # answers of the active grammar ('random' or 'first'), None is silence;
+    # delay seconds stand for the user talking, for capacity tests
+
+    def __init__(self, answers=None, choices=None, policy='random', seed=0, delay=0.0):
+        self.answers = list(answers or [])
+        self.choices = choices or {}
+        self.policy = policy
+        self.rng = random.Random(seed)
+        self.delay = delay
+        self.grammars = {}
+        self.search = None
+        self.spoken = 0
+        self.played = 0
+        self.recognitions = 0
+
+    def setLocal(self, local):
+        pass
+
+    def addGrammar(self, name, jsgf):
+        self.grammars[name] = jsgf
+
+    def useGrammar(self, name):
+        self.search = name
+
+    def speak(self, phrase):
+        self.spoken += 1
+
+    def play(self, filename):
+        self.played += 1
+
+    def recognize(self):
+        self.recognitions += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.answers:
+            return self.answers.pop(0)
+        options = self.choices.get(self.search)
+        if not options:
+            return None
+        if self.policy == 'first':
+            return options[0]
+        return self.rng.choice(options)
+
+    def close(self):
+        pass
+
+
+class SimulatedTraction(object):
+    def __init__(self):
+        self.moves = {}
+
+    def move(self, command):
+        self.moves[command] = self.moves.get(command, 0) + 1
+
+
+def choices(fsm_dic):
+    # every answer the recognizer could give, by grammar name
+    result = {}
+    for state, rec in fsm_dic['recognition_data'].items():
+        result.setdefault(fsm_dic['search_data'][state], list(rec['commands']))
+    return result
+
+
+def limit(robot, max_transitions):
+    # kill the robot after max_transitions states, programs may loop forever
+    count = [0]
+
+    def entered():
+        count[0] += 1
+        if count[0] == max_transitions:
+            robot.trigger('kill')
+
+    robot.after_state_change.append(entered)
+    return robot
+
+
+def placeholders(fsm_dic):
+    # audio files and actions without the database, for diagrams not stored
+    fsm_dic = dict(fsm_dic)
+    fsm_dic['audio_files'] = {state: 'audio-{}'.format(audio_id) for state, audio_id in fsm_dic['audio_data'].items()}
+    fsm_dic['actions'] = {state: {'category': 'simulated', 'action': str(action_id)}
+                          for state, action_id in fsm_dic['action_data'].items()}
+    return fsm_dic
+
+
+class Simulator(object):
+    # runs a compiled program headless and times every state: the time
+    # charged to a state goes from the end of the previous transition to the
+    # end of its own, on_enter work included
+
+    def __init__(self, fsm_dic, answers=None, policy='random', seed=0, max_transitions=10000):
+        self.fsm_dic = dict(fsm_dic)
+        self.fsm_dic.setdefault('local_proc', True)
+        self.answers = answers
+        self.policy = policy
+        self.seed = seed
+        self.max_transitions = max_transitions
+        self.kinds = {state['name']: state.get('on_enter', state['name']) for state in self.fsm_dic['states']}
+
+    @classmethod
+    def fromProgram(cls, program, **kwargs):
+        return cls(JsonFsm.resolve(program_cache.get(program)), **kwargs)
+
+    @classmethod
+    def fromDiagram(cls, diagram, resolve=False, **kwargs):
+        if isinstance(diagram, str):
+            diagram = json.loads(diagram)
+        fsm_dic = JsonFsm().compile(diagram)
+        return cls(JsonFsm.resolve(fsm_dic) if resolve else placeholders(fsm_dic), **kwargs)
+
+    def robot(self):
+        voice = SimulatedVoice(self.answers, choices(self.fsm_dic), self.policy, self.seed)
+        return Robot(self.fsm_dic, player=voice, traction=SimulatedTraction())
+
+    def run(self):
+        start = time.perf_counter()
+        robot = self.robot()
+        robot.open()
+        built = time.perf_counter()
+
+        durations = OrderedDict()
+        transitions = [0]
+        last = [built]
+
+        def entered():
+            now = time.perf_counter()
+            durations.setdefault(robot.state, []).append(now - last[0])
+            last[0] = now
+            transitions[0] += 1
+            if transitions[0] == self.max_transitions:
+                robot.trigger('kill')
+
+        robot.after_state_change.append(entered)
+        try:
+            robot.begin()
+        finally:
+            robot.close()
+        elapsed = time.perf_counter() - built
+
+        killed = robot.is_oblivion()
+        states = OrderedDict()
+        kinds = {}
+        for state, values in durations.items():
+            states[state] = {'count': len(values), 'mean_us': round(sum(values) / len(values) * 1e6, 2)}
+            kind = kinds.setdefault(self.kinds.get(state, state), [0, 0.0])
+            kind[0] += len(values)
+            kind[1] += sum(values)
+
+        return {
+            'result': 'stopped' if killed else 'completed',
+            'final_state': robot.state,
+            'transitions': transitions[0],
+            'build_ms': round((built - start) * 1000, 3),
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'transitions_per_s': round(transitions[0] / elapsed, 1) if elapsed else None,
+            'state_mean_us': round(elapsed / transitions[0] * 1e6, 2) if transitions[0] else None,
+            'kinds': {kind: {'count': count, 'mean_us': round(total / count * 1e6, 2)}
+                      for kind, (count, total) in kinds.items()},
+            'states': states,
+            'recognitions': robot.player.recognitions,
+            'spoken': robot.player.spoken,
+            'played': robot.player.played,
+            'moves': robot.traction.moves,
+        }
@@ -0,0 +1,58 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+from app import app, audio_ingest
+
+
+class BlobStore(object):
+    # files stored once by the sha256 of their content, in a two level
+    # sharded tree (ab/cd/abcd...ext) so directories stay small
+
+    def __init__(self, root, chunk_size=64 * 1024):
+        self.root = root
+        self.chunk_size = chunk_size
+        # held by callers across place/remove and the matching db commit so a
+        # blob isn't removed while a new row is about to reference it
+        self.lock = threading.RLock()
+
+    def path(self, digest, extension):
+        return os.path.join(self.root, digest[:2], digest[2:4], '{}.{}'.format(digest, extension))
+
+    def stage(self, stream):
+        # stream to a temporary file while hashing, returns (digest, tmp_path)
+        os.makedirs(self.root, exist_ok=True)
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    out.write(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return sha.hexdigest(), tmp_path
+
+    def place(self, digest, tmp_path, extension):
+        # move a staged file to its final path, returns (path, created)
+        filepath = self.path(digest, extension)
+        if os.path.exists(filepath):
+            os.remove(tmp_path)
+            return filepath, False
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        os.replace(tmp_path, filepath)
+        return filepath, True
+
+    def remove(self, filepath):
+        # the blob and its playback pcm, called when the last reference is gone
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        audio_ingest.remove(filepath)
+
+
+audio_store = BlobStore(app.config['AUDIOS_FOLDER'], app.config['AUDIO_UPLOAD_CHUNK'])
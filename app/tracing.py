@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import queue
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+from app import app
+
+
+class RunTrace(object):
+    # timeline of one run, events are [t_ms, kind, name, duration_ms, detail]
+    # with t_ms on the monotonic clock from the start of the run
+    FIELDS = ['t_ms', 'kind', 'name', 'duration_ms', 'detail']
+
+    def __init__(self, run_id, program_id, max_events=20000):
+        self.run_id = run_id
+        self.program_id = program_id
+        self.max_events = max_events
+        self.started = time.time()
+        self.t0 = time.monotonic()
+        self.events = []
+        self.dropped = 0
+        self.result = None
+        self.error = None
+        self.duration = None
+
+    def offset(self, when=None):
+        return round(((time.monotonic() if when is None else when) - self.t0) * 1000, 3)
+
+    def add(self, kind, name=None, start=None, duration=None, detail=None):
+        if len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        self.events.append([self.offset(start), kind, name,
+                            None if duration is None else round(duration * 1000, 3), detail])
+
+    def finish(self, result, error=None):
+        self.result = result
+        self.error = error
+        self.duration = self.offset()
+
+    def to_dict(self, min_ms=None):
+        # spans are added when they end, the timeline is ordered by start
+        events = sorted(self.events, key=lambda event: event[0])
+        if min_ms is not None:
+            events = [event for event in events if event[3] is not None and event[3] >= min_ms]
+        return {
+            'id': self.run_id,
+            'program_id': self.program_id,
+            'started': datetime.utcfromtimestamp(self.started).isoformat() + 'Z',
+            'complete': self.result is not None,
+            'result': self.result,
+            'error': self.error,
+            'duration_ms': self.duration if self.duration is not None else self.offset(),
+            'fields': self.FIELDS,
+            'events': events,
+            'dropped': self.dropped,
+        }
+
+
+class TraceStore(object):
+    # finished traces written by a background thread, one json file per run,
+    # the oldest removed past max_runs or max_age seconds; a full queue drops
+    # the trace instead of blocking the run
+
+    def __init__(self, folder, max_runs=1000, max_age=30 * 24 * 3600, queue_size=64):
+        self.folder = folder
+        self.max_runs = max_runs
+        self.max_age = max_age
+        self.queue = queue.Queue(queue_size)
+        self.index = OrderedDict()
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        os.makedirs(self.folder, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        entries = [entry for entry in os.scandir(self.folder)
+                   if entry.is_file() and entry.name.endswith('.json')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            self.index[entry.name[:-5]] = entry.stat().st_mtime
+        self.expire()
+
+    def path(self, run_id):
+        return os.path.join(self.folder, run_id + '.json')
+
+    def save(self, trace):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.write, daemon=True)
+                self.thread.start()
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+            app.logger.warning('trace of run {} dropped, writer behind'.format(trace.run_id))
+
+    def write(self):
+        while True:
+            trace = self.queue.get()
+            try:
+                filepath = self.path(trace.run_id)
+                tmp_path = filepath + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(trace.to_dict(), f, separators=(',', ':'))
+                os.replace(tmp_path, filepath)
+                with self.lock:
+                    self.index[trace.run_id] = time.time()
+                    self.expire()
+            except Exception as exc:
+                app.logger.error(exc)
+            finally:
+                self.queue.task_done()
+
+    def expire(self):
+        limit = time.time() - self.max_age
+        while self.index:
+            run_id, written = next(iter(self.index.items()))
+            if len(self.index) <= self.max_runs and written >= limit:
+                break
+            del self.index[run_id]
+            if os.path.exists(self.path(run_id)):
+                os.remove(self.path(run_id))
+
+    def get(self, run_id):
+        # the stored trace as a dict, None when unknown or expired
+        if not run_id.isalnum():
+            return None
+        with self.lock:
+            if run_id not in self.index:
+                return None
+        try:
+            with open(self.path(run_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+trace_store = TraceStore(app.config['TRACE_FOLDER'], app.config['TRACE_MAX_RUNS'],
+                         app.config['TRACE_MAX_AGE'], app.config['TRACE_QUEUE_SIZE'])
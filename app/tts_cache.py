@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class TtsCache(object):
+    # synthesized phrases on disk, addressed by a hash of text, voice, engine and
+    # audio config, evicted least recently used first once max_bytes is exceeded
+
+    def __init__(self, folder, max_bytes=200 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.index = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        # rebuild the index from disk, oldest use first
+        entries = [entry for entry in os.scandir(self.folder)
+                   if entry.is_file() and not entry.name.endswith('.tmp')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            size = entry.stat().st_size
+            self.index[entry.name] = size
+            self.size += size
+        self.evict()
+
+    @staticmethod
+    def key(text, voice, engine, audio_config):
+        data = json.dumps([engine, voice, audio_config, text], sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get(self, text, voice, engine, audio_config, synthesize, extension):
+        # path of the cached audio, synthesize(text, filepath) fills misses
+        name = '{}.{}'.format(self.key(text, voice, engine, audio_config), extension)
+        filepath = os.path.join(self.folder, name)
+
+        with self.lock:
+            if name in self.index and os.path.exists(filepath):
+                self.index.move_to_end(name)
+                self.hits += 1
+                os.utime(filepath)
+                return filepath
+            self.misses += 1
+
+        tmp_path = filepath + '.{}.tmp'.format(threading.get_ident())
+        try:
+            synthesize(text, tmp_path)
+            os.replace(tmp_path, filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        size = os.path.getsize(filepath)
+        with self.lock:
+            self.size += size - self.index.pop(name, 0)
+            self.index[name] = size
+            self.evict(keep=name)
+        return filepath
+
+    def evict(self, keep=None):
+        while self.size > self.max_bytes and self.index:
+            name, size = next(iter(self.index.items()))
+            if name == keep:
+                break
+            del self.index[name]
+            self.size -= size
+            filepath = os.path.join(self.folder, name)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def stats(self):
+        return {
+            'entries': len(self.index),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
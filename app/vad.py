@@ -0,0 +1,60 @@
+import audioop
+
+
+class EnergyVad(object):
+    # frame energy voice activity detector, the noise floor follows the quiet frames
+    SILENCE = 0
+    SPEECH = 1
+    END = 2
+
+    def __init__(self, sample_rate=16000, sample_width=2, noise_floor=100.0, ratio=3.0,
+                 min_energy=150.0, end_silence=0.5, min_speech=0.15, start_timeout=8.0,
+                 max_utterance=10.0, adapt=0.05):
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.noise_floor = noise_floor
+        self.ratio = ratio
+        self.min_energy = min_energy
+        # seconds
+        self.end_silence = end_silence
+        self.min_speech = min_speech
+        self.start_timeout = start_timeout
+        self.max_utterance = max_utterance
+        self.adapt = adapt
+
+        self.elapsed = 0.0
+        self.speech = 0.0
+        self.silence = 0.0
+        self.heard_speech = False
+
+    def threshold(self):
+        return max(self.min_energy, self.noise_floor * self.ratio)
+
+    def isSpeech(self, frame):
+        energy = audioop.rms(frame, self.sample_width)
+        if energy > self.threshold():
+            return True
+        self.noise_floor += self.adapt * (energy - self.noise_floor)
+        return False
+
+    def feed(self, frame):
+        # returns SILENCE, SPEECH or END once the utterance is over
+        duration = len(frame) / float(self.sample_width * self.sample_rate)
+        self.elapsed += duration
+
+        if self.isSpeech(frame):
+            self.speech += duration
+            self.silence = 0.0
+            if self.speech >= self.min_speech:
+                self.heard_speech = True
+            state = self.SPEECH
+        else:
+            self.silence += duration
+            state = self.SILENCE
+
+        if self.heard_speech:
+            if self.silence >= self.end_silence or self.elapsed >= self.max_utterance:
+                return self.END
+        elif self.elapsed >= self.start_timeout:
+            return self.END
+        return state
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import threading
+
+from app import app
+from app.robot import TestVoice
+from app.tts_cache import TtsCache
+from app.playback import Player, ClipCache
+
+
+class VoiceEngine(object):
+    # one warm TestVoice shared by every run: decoder, microphone calibration and tts
+    # are built once, in parallel, and the noise floor survives restarts
+
+    # warm up steps a run can't do without
+    REQUIRED = ('decoder', 'player')
+
+    def __init__(self, raspi=False, calibration_file=None, recalibrate_interval=600, tts_cache=None,
+                 clip_cache_size=64, input_device=None, output_device=None):
+        self.voice = TestVoice(raspi=raspi, warm=False, input_device=input_device, output_device=output_device)
+        self.voice.tts_cache = tts_cache
+        self.voice.player = Player(self.voice.audio, ClipCache(clip_cache_size), output_device=output_device)
+        self.calibration_file = calibration_file
+        self.recalibrate_interval = recalibrate_interval
+
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+        self.busy = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.thread = None
+
+        self.warmup_time = None
+        self.calibrated = None
+        self.errors = {}
+
+    def start(self):
+        # a thread started before a fork doesn't exist in the child, warm up again there
+        with self.start_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.ready.clear()
+                self.thread = threading.Thread(target=self.run, name='voice-engine', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def close(self):
+        # for engines of removed sessions, waits for a warm up in progress
+        self.stop()
+        if self.thread is not None:
+            self.thread.join()
+        self.voice.close()
+
+    def run(self):
+        self.warmUp()
+        # recalibrate between runs, never while a robot is using the microphone
+        while not self.stopped.wait(self.recalibrate_interval):
+            if self.busy.acquire(blocking=False):
+                try:
+                    self.calibrate()
+                finally:
+                    self.busy.release()
+
+    def steps(self):
+        return {
+            'decoder': self.voice.initDecoder,
+            'player': self.voice.player.start,
+            'tts': lambda: self.voice.initTts(True),
+        }
+
+    def warmUp(self):
+        start = time.time()
+        self.errors.clear()
+        steps = self.steps()
+        # a persisted noise floor is used right away, recalibration comes later
+        if self.loadCalibration() is None:
+            steps['calibration'] = self.calibrate
+        if os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
+            steps['tts_cloud'] = lambda: self.voice.initTts(False)
+
+        threads = [threading.Thread(target=self.step, args=(name, step), daemon=True)
+                   for name, step in steps.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.warmup_time = time.time() - start
+        app.logger.info('voice engine warm in {:.2f}s'.format(self.warmup_time))
+        self.ready.set()
+
+    def step(self, name, step):
+        try:
+            step()
+        except Exception as exc:
+            app.logger.error('voice engine {}: {}'.format(name, exc))
+            self.errors[name] = str(exc)
+        else:
+            self.errors.pop(name, None)
+
+    def retry(self):
+        # warm up again the required steps that failed, a device plugged in
+        # after boot doesn't need a restart; called holding busy
+        steps = self.steps()
+        for name in sorted(self.failed()):
+            self.step(name, steps[name])
+
+    def calibrate(self):
+        threshold = self.voice.calibrate()
+        self.calibrated = time.time()
+        self.saveCalibration(threshold)
+
+    def loadCalibration(self):
+        if not self.calibration_file or not os.path.exists(self.calibration_file):
+            return None
+        try:
+            with open(self.calibration_file, 'r') as f:
+                calibration = json.load(f)
+            self.voice.r.energy_threshold = calibration['energy_threshold']
+            self.calibrated = calibration['calibrated']
+            return calibration
+        except (ValueError, KeyError) as exc:
+            app.logger.error('invalid voice calibration: {}'.format(exc))
+            return None
+
+    def saveCalibration(self, threshold):
+        if not self.calibration_file:
+            return
+        with open(self.calibration_file, 'w') as out:
+            json.dump({'energy_threshold': threshold, 'calibrated': self.calibrated}, out)
+
+    def failed(self):
+        return {name: error for name, error in self.errors.items() if name in self.REQUIRED}
+
+    def acquire(self, local=True, timeout=None):
+        # hand the shared voice to one run, release() gives it back
+        self.start()
+        if not self.ready.wait(timeout):
+            raise RuntimeError('voice engine is still warming up')
+        if not self.busy.acquire(timeout=-1 if timeout is None else timeout):
+            raise RuntimeError('voice engine is busy')
+        try:
+            self.retry()
+            failed = self.failed()
+            if failed:
+                raise RuntimeError('voice engine failed to start: ' +
+                                   ', '.join('{}: {}'.format(name, error) for name, error in sorted(failed.items())))
+            self.voice.setLocal(local)
+        except Exception:
+            self.busy.release()
+            raise
+        return self.voice
+
+    def release(self):
+        self.busy.release()
+
+    def status(self):
+        return {
+            'ready': self.ready.is_set() and not self.failed(),
+            'busy': self.busy.locked(),
+            'warmup_time': self.warmup_time,
+            'energy_threshold': self.voice.r.energy_threshold,
+            'calibrated': self.calibrated,
+            'searches': len(self.voice.searches),
+            'tts_cache': self.voice.tts_cache.stats() if self.voice.tts_cache else None,
+            'errors': self.errors
+        }
+
+
+voice_engine = VoiceEngine(app.config['RASPI'], app.config['VOICE_CALIBRATION_FILE'],
+                           app.config['VOICE_RECALIBRATE_INTERVAL'],
+                           TtsCache(app.config['TTS_CACHE_FOLDER'], app.config['TTS_CACHE_MAX_BYTES']),
+                           app.config['CLIP_CACHE_SIZE'])
@@ -0,0 +1,62 @@
+import json
+import time
+import hashlib
+import threading
+from bisect import bisect_left
+
+from sqlalchemy import func
+
+from app import db
+from app.models import Word
+
+
+class WordIndex(object):
+    # the dictionary as a sorted list for prefix lookups, rebuilt when the
+    # word table changes (checked at most every check_interval seconds)
+
+    def __init__(self, check_interval=5):
+        self.check_interval = check_interval
+        self.words = []
+        self.body = b'[]'
+        self.etag = None
+        self.signature = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        now = time.time()
+        if now - self.checked < self.check_interval:
+            return
+        with self.lock:
+            if now - self.checked < self.check_interval:
+                return
+            signature = tuple(db.session.query(func.count(Word.id), func.max(Word.id)).one())
+            if signature != self.signature:
+                self.rebuild()
+                self.signature = signature
+            self.checked = now
+
+    def rebuild(self):
+        words = sorted(set(w for (w,) in db.session.query(Word.word) if w))
+        body = json.dumps(words, separators=(',', ':')).encode('utf-8')
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.body = body
+        self.words = words
+
+    def invalidate(self):
+        with self.lock:
+            self.signature = None
+            self.checked = 0
+
+    def prefix(self, hint, limit=None, offset=0):
+        words = self.words
+        hint = hint.lower()
+        start = bisect_left(words, hint)
+        end = bisect_left(words, hint[:-1] + chr(ord(hint[-1]) + 1)) if hint else len(words)
+        start = min(start + offset, end)
+        if limit is not None:
+            end = min(end, start + limit)
+        return words[start:end]
+
+
+word_index = WordIndex()
@@ -0,0 +1,327 @@
+"""Latency, throughput and peak RSS of the http api on a seeded throwaway
+database, through the flask test client and a threaded werkzeug server at
+several concurrency levels. Results are written as JSON to compare versions.
+
+    python benchmarks/api_bench.py --concurrency 1,4,16 --requests 200 --out api.json
+    python benchmarks/api_bench.py --only 'audio|words' --modes server
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# endpoints not driven: they need a logged in session or the robot hardware,
+# or they would drain the seeded data between iterations
+SKIPPED = {
+    '/api/programs/<id>/run': 'starts the robot',
+    '/api/programs/stop': 'needs a running program',
+    '/api/sessions/...': 'starts robots, see session_bench.py',
+    '/index, /user/<username>, /edit_profile': 'login required',
+    '/register, /logout, POST /login': 'session endpoints',
+    'DELETE /api/...': 'removes seeded rows',
+}
+
+
+def form(fields):
+    return {'Content-Type': 'application/x-www-form-urlencoded'}, urlencode(fields).encode()
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append('--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'
+                     .format(boundary, name, value).encode())
+    for name, (filename, data) in files.items():
+        parts.append('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n'
+                     'Content-Type: application/octet-stream\r\n\r\n'.format(boundary, name, filename).encode())
+        parts.append(data + b'\r\n')
+    parts.append('--{}--\r\n'.format(boundary).encode())
+    return {'Content-Type': 'multipart/form-data; boundary=' + boundary}, b''.join(parts)
+
+
+def endpoints(volumes, small_diagram, clip):
+    audios, programs = volumes['audios'], volumes['programs']
+
+    def get(path, headers=None):
+        return lambda i: ('GET', path.format(i=i, audio=i % audios + 1, program=i % programs + 1),
+                          headers or {}, None)
+
+    def put_program(i):
+        program = 10 + i % 10
+        headers, body = form({'name': 'program{}'.format(program - 1), 'description': 'bench',
+                              'content': json.dumps(small_diagram)})
+        return 'PUT', '/api/programs/{}'.format(program), headers, body
+
+    def post_category(i):
+        headers, body = form({'name': 'bench' + uuid.uuid4().hex[:12]})
+        return 'POST', '/api/audios/categories', headers, body
+
+    def post_audio(i):
+        # same bytes every time, the stored file is shared
+        headers, body = multipart({'content': 'bench', 'category_id': 1},
+                                  {'file': ('bench{}.wav'.format(uuid.uuid4().hex[:12]), clip)})
+        return 'POST', '/api/audios', headers, body
+
+    return [
+        ('audio_list_page', get('/api/audios?limit=50&cursor={i}')),
+        ('audio_list_all', get('/api/audios')),
+        ('audio_list_category', get('/api/audios?category_id=3&limit=50')),
+        ('audio_list_fields', get('/api/audios?fields=id,name&limit=200')),
+        ('audio_get', get('/api/audios/{audio}')),
+        ('audio_file', get('/api/audios/1/file')),
+        ('audio_file_range', get('/api/audios/1/file', {'Range': 'bytes=1000-8999'})),
+        ('audio_category_list', get('/api/audios/categories')),
+        ('audio_category_get', get('/api/audios/categories/1')),
+        ('program_list_meta', get('/api/programs?meta=true&limit=50')),
+        ('program_list', get('/api/programs?limit=50&cursor={i}')),
+        ('program_get', get('/api/programs/{program}')),
+        ('program_get_large', get('/api/programs/1')),
+        ('words', get('/api/words')),
+        ('words_hint', get('/api/words/ab?limit=20')),
+        ('actions', get('/api/actions')),
+        ('action_get', get('/api/actions/1')),
+        ('run_status', get('/api/runs/missing')),
+        ('voice_ready', get('/api/voice/ready')),
+        ('login_page', get('/login')),
+        ('program_put', put_program),
+        ('audio_category_post', post_category),
+        ('audio_post', post_audio),
+    ]
+
+
+class TestClientTarget(object):
+    name = 'test_client'
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, headers, body):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, headers=headers, data=body)
+        response.get_data()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class ServerTarget(object):
+    name = 'server'
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server, WSGIRequestHandler
+
+        class Handler(WSGIRequestHandler):
+            # keep-alive so the clients measure requests, not connects, and
+            # no nagle so the split header/body writes don't wait for an ack
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=Handler)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.local = threading.local()
+
+    def request(self, method, path, headers, body):
+        for attempt in range(2):
+            connection = getattr(self.local, 'connection', None)
+            if connection is None:
+                connection = self.local.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    connection.close()
+                    self.local.connection = None
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def drive(target, build, requests, concurrency):
+    latencies = []
+    statuses = {}
+    errors = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            method, path, headers, body = build(i)
+            start = time.perf_counter()
+            try:
+                status = target.request(method, path, headers, body)
+            except Exception as exc:
+                with lock:
+                    errors.append(repr(exc))
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    result = {
+        'requests': len(latencies),
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'errors': len(errors) + sum(v for k, v in statuses.items() if k >= 500),
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        'rss_kb': rss_kb(),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if latencies:
+        result.update({
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+        })
+    if errors:
+        result['first_error'] = errors[0]
+    return result
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,4,16')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and level')
+    parser.add_argument('--modes', default='test_client,server')
+    parser.add_argument('--only', help='regex on the endpoint names')
+    parser.add_argument('--audios', type=int, default=10000)
+    parser.add_argument('--programs', type=int, default=1000)
+    parser.add_argument('--words', type=int, default=20000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--large-nodes', type=int, default=2000)
+    parser.add_argument('--out')
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(',')]
+    modes = args.modes.split(',')
+
+    folder = tempfile.mkdtemp(prefix='nayra_bench_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(folder, 'bench.db')
+    sys.path.insert(0, ROOT)
+    os.chdir(folder)
+
+    import logging
+    from flask_migrate import upgrade
+    from app import app, db
+    from app.storage import audio_store
+    from benchmarks.seed import seed, diagram, wav_bytes
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('alembic').setLevel(logging.WARNING)
+    app.config['PROGRAMS_FOLDER'] = os.path.join(folder, 'programs')
+    app.config['AUDIOS_FOLDER'] = audio_store.root = os.path.join(folder, 'audios')
+    volumes = {'audios': args.audios, 'programs': args.programs, 'words': args.words,
+               'categories': args.categories, 'large_nodes': args.large_nodes}
+
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, 'migrations'))
+        start = time.perf_counter()
+        seed(audios=args.audios, programs=args.programs, words_count=args.words,
+             categories=args.categories, folder=folder, large_nodes=args.large_nodes)
+        seed_s = round(time.perf_counter() - start, 3)
+        db.session.remove()
+
+    report = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'volumes': volumes,
+        'seed_s': seed_s,
+        'requests': args.requests,
+        'skipped': SKIPPED,
+        'results': {},
+    }
+    targets = {'test_client': TestClientTarget, 'server': ServerTarget}
+    small_diagram = diagram(12, args.audios)
+    clip = wav_bytes()
+    for name, build in endpoints(volumes, small_diagram, clip):
+        if args.only and not re.search(args.only, name):
+            continue
+        report['results'][name] = {}
+        for mode in modes:
+            target = targets[mode](app)
+            try:
+                # caches warm before measuring
+                target.request(*build(0))
+                for level in levels:
+                    result = drive(target, build, args.requests, level)
+                    report['results'][name]['{}_c{}'.format(mode, level)] = result
+                    print('{:22} {:12} c={:<3} p50={:>9} p99={:>9} rps={:>8} errors={}'.format(
+                        name, mode, level, result.get('p50_ms'), result.get('p99_ms'),
+                        result['throughput_rps'], result['errors']), file=sys.stderr)
+            finally:
+                target.close()
+    report['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out if os.path.isabs(args.out) else os.path.join(ROOT, args.out), 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
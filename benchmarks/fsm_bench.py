@@ -0,0 +1,117 @@
+"""Headless runs of programs through the simulator: parse and compile time,
+robot build time, transitions per second and per-state overhead, as JSON.
+
+    python benchmarks/fsm_bench.py --nodes 10,100,500 --runs 5 --out fsm.json
+    python benchmarks/fsm_bench.py --program 3 --answers si,no   # a stored program, app database
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+def summary(runs):
+    # means of the numeric fields over the runs, per kind overhead merged
+    result = {key: round(mean([run[key] for run in runs]), 3)
+              for key in ('transitions', 'build_ms', 'elapsed_ms', 'transitions_per_s', 'state_mean_us')}
+    kinds = {}
+    for run in runs:
+        for kind, data in run['kinds'].items():
+            kinds.setdefault(kind, []).append(data['mean_us'])
+    result['kinds_mean_us'] = {kind: round(mean(values), 2) for kind, values in kinds.items()}
+    result['results'] = sorted(set(run['result'] for run in runs))
+    return result
+
+
+def bench_diagram(Simulator, JsonFsm, text, args):
+    parse, compile_ = [], []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        diagram = json.loads(text)
+        parsed = time.perf_counter()
+        JsonFsm().compile(diagram)
+        compiled = time.perf_counter()
+        parse.append((parsed - start) * 1000)
+        compile_.append((compiled - parsed) * 1000)
+
+    runs = []
+    for i in range(args.runs):
+        simulator = Simulator.fromDiagram(diagram, resolve=args.resolve, answers=args.answers,
+                                          policy=args.policy, seed=args.seed + i,
+                                          max_transitions=args.max_transitions)
+        runs.append(simulator.run())
+
+    result = {'bytes': len(text), 'parse_ms': round(mean(parse), 3), 'compile_ms': round(mean(compile_), 3)}
+    result.update(summary(runs))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', default='10,100,500', help='sizes of the generated diagrams')
+    parser.add_argument('--program', type=int, action='append', help='stored program id, repeatable')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--answers', help='comma separated recognizer answers given first')
+    parser.add_argument('--policy', default='random', choices=['random', 'first'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-transitions', type=int, default=10000)
+    parser.add_argument('--verbose', action='store_true', help='keep the robot prints')
+    parser.add_argument('--out')
+    args = parser.parse_args()
+    args.answers = args.answers.split(',') if args.answers else None
+    args.resolve = False
+
+    sys.path.insert(0, ROOT)
+    from app import app
+    from app.models import Program
+    from app.fsm_parser import JsonFsm
+    from app.simulator import Simulator
+    from benchmarks.seed import diagram
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'fsm_queued': app.config['FSM_QUEUED'],
+        'runs': args.runs,
+        'policy': args.policy,
+        'max_transitions': args.max_transitions,
+        'diagrams': {},
+        'programs': {},
+    }
+    # the robot prints every state, measured but not shown unless asked
+    output = sys.stdout if args.verbose else open(os.devnull, 'w')
+    with app.app_context(), contextlib.redirect_stdout(output):
+        if args.program:
+            args.resolve = True
+            for program_id in args.program:
+                program = Program.query.get(program_id)
+                if program is None:
+                    report['programs'][program_id] = {'error': 'program not found'}
+                    continue
+                with open(program.filepath) as f:
+                    text = f.read()
+                report['programs'][program_id] = bench_diagram(Simulator, JsonFsm, text, args)
+        else:
+            for nodes in [int(n) for n in args.nodes.split(',')]:
+                text = json.dumps(diagram(nodes, seed_value=args.seed))
+                report['diagrams'][nodes] = bench_diagram(Simulator, JsonFsm, text, args)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out if os.path.isabs(args.out) else os.path.join(ROOT, args.out), 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
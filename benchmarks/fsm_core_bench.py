@@ -0,0 +1,206 @@
+"""The table-driven fsm core against transitions.Machine on generated
+programs: build time, memory and time per event, with triggers fired from
+outside and chained from on_enter as the robot does. Both engines walk the
+same trigger sequence and must end every step in the same state.
+
+    python benchmarks/fsm_core_bench.py --nodes 10,100,500 --events 100000 --out fsm_core.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CALLBACKS = ('presentation', 'speak', 'audio', 'recognition', 'terminate')
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+def engines():
+    from transitions import Machine
+    from app.fsm_core import FsmCore, FsmTable
+
+    class Engine(object):
+        # the robot without its devices: no-op hooks, on_enter fires the
+        # next trigger of the walk when chained
+        walk = None
+        entered = 0
+
+        def stateLeaving(self):
+            pass
+
+        def stateEntered(self):
+            self.entered += 1
+
+        def step(self):
+            if self.walk is not None:
+                trigger = next(self.walk, None)
+                if trigger is not None:
+                    self.trigger(trigger)
+
+    for name in CALLBACKS:
+        setattr(Engine, name, Engine.step)
+
+    class MachineEngine(Engine, Machine):
+        def __init__(self, fsm_dic, table=None):
+            Machine.__init__(self, states=fsm_dic['states'], transitions=fsm_dic['transitions'],
+                             initial='init', ignore_invalid_triggers=True, queued=True,
+                             before_state_change='stateLeaving', after_state_change='stateEntered')
+
+    class CoreEngine(Engine, FsmCore):
+        def __init__(self, fsm_dic, table=None):
+            table = table or FsmTable(fsm_dic['states'], fsm_dic['transitions'])
+            FsmCore.__init__(self, table, queued=True, ignore_invalid_triggers=True,
+                             before_state_change='stateLeaving', after_state_change='stateEntered')
+
+    return MachineEngine, CoreEngine, FsmTable
+
+
+def walk(table, length, seed):
+    # begin, then random valid triggers avoiding dead ends, with a few
+    # ignored begins mixed in; kill is left out so the walk keeps going
+    rng = random.Random(seed)
+    names = {record.id: record.name for record in table.records}
+    options = {}
+    for (source, trigger), dest in table.table.items():
+        if trigger != 'kill':
+            options.setdefault(source, []).append((trigger, dest))
+    live = options
+    while True:
+        pruned = {source: [(t, d) for t, d in out if d in live] for source, out in live.items()}
+        pruned = {source: out for source, out in pruned.items() if out}
+        if len(pruned) == len(live):
+            break
+        live = pruned
+    sequence = ['begin']
+    state = table.table[(table.initial, 'begin')]
+    while len(sequence) < length and live.get(state):
+        if rng.random() < 0.05:
+            sequence.append('begin')
+            continue
+        trigger, state = rng.choice(sorted(live[state]))
+        sequence.append(trigger)
+    return sequence, names[state]
+
+
+def build(cls, fsm_dic, runs, table=None):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        cls(fsm_dic, table)
+        times.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    engine = cls(fsm_dic, table)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del engine
+    return {'build_ms': round(mean(times), 3), 'min_build_ms': round(min(times), 3), 'build_kb': round(size / 1024, 1)}
+
+
+def external(cls, fsm_dic, sequence):
+    engine = cls(fsm_dic)
+    trigger = engine.trigger
+    start = time.perf_counter()
+    for name in sequence:
+        trigger(name)
+    elapsed = time.perf_counter() - start
+    return elapsed, len(sequence), engine
+
+
+def chained(cls, fsm_dic, sequence):
+    # an ignored trigger enters no state and would end the chain
+    sequence = sequence[:1] + [name for name in sequence[1:] if name != 'begin']
+    engine = cls(fsm_dic)
+    engine.walk = iter(sequence[1:])
+    start = time.perf_counter()
+    engine.trigger(sequence[0])
+    elapsed = time.perf_counter() - start
+    return elapsed, len(sequence), engine
+
+
+def equivalent(MachineEngine, CoreEngine, fsm_dic, sequence):
+    machine, core = MachineEngine(fsm_dic), CoreEngine(fsm_dic)
+    for name in sequence + ['kill', 'begin', 'retry']:
+        if machine.trigger(name) != core.trigger(name) or machine.state != core.state:
+            return False
+    return machine.entered == core.entered
+
+
+def bench(fsm_dic, args):
+    MachineEngine, CoreEngine, FsmTable = engines()
+    start = time.perf_counter()
+    table = FsmTable(fsm_dic['states'], fsm_dic['transitions'])
+    table_ms = (time.perf_counter() - start) * 1000
+    sequence, final = walk(table, args.events, args.seed)
+
+    result = {
+        'states': len(fsm_dic['states']),
+        'transitions': len(table.table),
+        'events': len(sequence),
+        'table_ms': round(table_ms, 3),
+        'equivalent': equivalent(MachineEngine, CoreEngine, fsm_dic, sequence),
+    }
+    for name, cls in (('machine', MachineEngine), ('core', CoreEngine)):
+        data = build(cls, fsm_dic, args.runs)
+        if cls is CoreEngine:
+            data['shared_table_build_ms'] = build(cls, fsm_dic, args.runs, table)['build_ms']
+        for mode, drive in (('external', external), ('chained', chained)):
+            elapsed, events, engine = drive(cls, fsm_dic, sequence)
+            data[mode + '_events_per_s'] = round(events / elapsed, 1)
+            data[mode + '_event_us'] = round(elapsed / events * 1e6, 3)
+            data[mode + '_final_ok'] = engine.state == final
+        result[name] = data
+    for key in ('build_ms', 'external_event_us', 'chained_event_us'):
+        result[key.replace('_ms', '').replace('_us', '') + '_speedup'] = round(
+            result['machine'][key] / result['core'][key], 1) if result['core'][key] else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', default='10,100,500', help='sizes of the generated diagrams')
+    parser.add_argument('--events', type=int, default=100000, help='length of the trigger walk')
+    parser.add_argument('--runs', type=int, default=3, help='builds averaged per engine')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    import logging
+    from app import app
+    from app.fsm_parser import JsonFsm
+    from benchmarks.seed import diagram
+
+    # transitions logs every ignored trigger
+    logging.getLogger('transitions').setLevel(logging.ERROR)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'events': args.events,
+        'runs': args.runs,
+        'diagrams': {},
+    }
+    with app.app_context():
+        for nodes in [int(n) for n in args.nodes.split(',')]:
+            fsm_dic = JsonFsm().compile(diagram(nodes, seed_value=args.seed))
+            report['diagrams'][nodes] = result = bench(fsm_dic, args)
+            print('{:>6} nodes  build x{:<8} external x{:<6} chained x{:<6} equivalent={}'.format(
+                nodes, result['build_speedup'], result['external_event_speedup'],
+                result['chained_event_speedup'], result['equivalent']), file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out if os.path.isabs(args.out) else os.path.join(ROOT, args.out), 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""EXPLAIN QUERY PLAN and timings of the queries behind the API, on a seeded
+throwaway sqlite database built by the migrations.
+
+    python benchmarks/query_plans.py --revision head --out plans.json
+    python benchmarks/query_plans.py --revision bd89de30b43e   # before the index audit
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def queries(db, models, true):
+    Audio, Program, Word, Action, User = models
+    since = datetime(2019, 1, 2)
+    # the same statements the resources and routes build
+    return {
+        'program_active': lambda: Program.query.filter(Program.active == true()).first(),
+        'program_by_id': lambda: Program.query.filter_by(id=500).first(),
+        'program_page_modified': lambda: db.session.query(Program.id, Program.modified, Program.name)
+            .filter(Program.modified > since).order_by(Program.modified, Program.id).limit(51).all(),
+        'audio_by_name': lambda: Audio.query.filter_by(name='audio5000.wav').first(),
+        'audio_refcount': lambda: Audio.query.filter_by(filepath=Audio.query.get(12).filepath).count(),
+        'audio_page_category': lambda: db.session.query(Audio.id, Audio.name, Audio.category_id)
+            .filter(Audio.category_id == 3).filter(Audio.id > 2000).order_by(Audio.id).limit(51).all(),
+        'audio_page_modified': lambda: db.session.query(Audio.id, Audio.modified, Audio.name)
+            .filter(Audio.modified > since).order_by(Audio.modified, Audio.id).limit(51).all(),
+        'audio_resolve': lambda: db.session.query(Audio.id, Audio.filepath)
+            .filter(Audio.id.in_(list(range(100, 140)))).all(),
+        'action_page_category': lambda: db.session.query(Action.id, Action.category, Action.action)
+            .filter(Action.category == 'category1').order_by(Action.id).all(),
+        'word_prefix': lambda: db.session.query(Word.word)
+            .filter(Word.word >= 'ab', Word.word < 'ac').order_by(Word.word).limit(50).all(),
+        'word_signature': lambda: db.session.query(db.func.count(Word.id), db.func.max(Word.id)).one(),
+        'user_by_username': lambda: User.query.filter_by(username='user3').first(),
+    }
+
+
+class PlanRecorder(object):
+    # runs a query once with its statements prefixed by EXPLAIN QUERY PLAN
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.active = False
+        self.plans = []
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self.before, retval=True)
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active:
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            self.plans.append({'sql': ' '.join(statement.split()),
+                               'plan': [row[-1] for row in cursor.fetchall()]})
+        return statement, parameters
+
+    def record(self, run):
+        self.plans = []
+        self.active = True
+        try:
+            run()
+        finally:
+            self.active = False
+        return self.plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--revision', default='head')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--audios', type=int, default=10000)
+    parser.add_argument('--words', type=int, default=20000)
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='nayra_bench_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(folder, 'bench.db')
+    sys.path.insert(0, ROOT)
+    os.chdir(folder)
+
+    from flask_migrate import upgrade
+    from sqlalchemy import true
+    from app import app, db
+    from app.models import Audio, Program, Word, Action, User
+    from benchmarks.seed import seed
+
+    report = {'revision': args.revision, 'repeat': args.repeat, 'queries': {}}
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, 'migrations'), revision=args.revision)
+        # inserts pay for every index on the table
+        start = time.perf_counter()
+        seed(audios=args.audios, words_count=args.words)
+        report['seed_s'] = round(time.perf_counter() - start, 3)
+        report['pragmas'] = {name: db.session.execute('PRAGMA {}'.format(name)).scalar()
+                             for name in ('journal_mode', 'synchronous', 'busy_timeout')}
+        report['indexes'] = sorted(name for (name,) in db.session.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_%'"))
+
+        recorder = PlanRecorder(db.engine)
+        for name, run in queries(db, (Audio, Program, Word, Action, User), true).items():
+            try:
+                plans = recorder.record(run)
+            except Exception as exc:
+                db.session.rollback()
+                report['queries'][name] = {'error': str(exc).splitlines()[0]}
+                continue
+            timings = []
+            for _ in range(args.repeat):
+                db.session.expire_all()
+                start = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - start) * 1000)
+            report['queries'][name] = {
+                'plans': plans,
+                'mean_ms': round(sum(timings) / len(timings), 4),
+                'p50_ms': round(percentile(timings, 0.5), 4),
+                'p99_ms': round(percentile(timings, 0.99), 4),
+            }
+        db.session.remove()
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(os.path.join(ROOT, args.out) if not os.path.isabs(args.out) else args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Seed data for the benchmarks, written with bulk core inserts into whatever
+database the app is configured with (the benchmarks point it at a throwaway one).
+"""
+import io
+import os
+import json
+import math
+import wave
+import random
+import struct
+import hashlib
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import User, Audio, AudioCategory, Program, Word, Action
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+BATCH = 1000
+
+
+def columns(model):
+    return set(column['name'] for column in db.inspect(db.engine).get_columns(model.__table__.name))
+
+
+def insert(model, rows):
+    # only the columns the migrated schema has, older revisions lack some
+    table = model.__table__
+    names = columns(model)
+    rows = [{k: v for k, v in row.items() if k in names} for row in rows]
+    for i in range(0, len(rows), BATCH):
+        db.session.execute(table.insert(), rows[i:i + BATCH])
+
+
+def words(n, rng):
+    seen = set()
+    while len(seen) < n:
+        seen.add(''.join(rng.choice(LETTERS) for _ in range(rng.randint(3, 12))))
+    return sorted(seen)
+
+
+def diagram(nodes, audios=1, actions=1, seed_value=0):
+    # presentation, then speak / recognition / audio nodes in a chain with
+    # back edges from the recognitions, then terminate
+    rng = random.Random(seed_value)
+    nodes = max(nodes, 3)
+    kinds = ['Speak', 'Recognition: {}', 'Audio']
+    diagram_nodes = {}
+    for i in range(1, nodes + 1):
+        following = {'connections': [{'node': i + 1}]}
+        if i == 1:
+            node = {'name': 'Presentation', 'data': {'key': 'text', 'text': 'hola'}, 'outputs': {'end': following}}
+        elif i == nodes:
+            node = {'name': 'Terminate', 'data': {'key': 'text', 'text': 'adios'}, 'outputs': {}}
+        else:
+            kind = kinds[i % len(kinds)]
+            if kind == 'Speak':
+                node = {'name': kind, 'data': {'text': 'nodo {}'.format(i)}, 'outputs': {'end': following}}
+            elif kind == 'Audio':
+                node = {'name': kind, 'data': {'key': 'audio', 'audio': rng.randint(1, audios),
+                                               'action': rng.randint(1, actions)},
+                        'outputs': {'end': following}}
+            else:
+                node = {'name': kind.format(i), 'data': {'si': 'si claro', 'no': 'no gracias'},
+                        'outputs': {'si': following, 'no': {'connections': [{'node': rng.randint(2, i)}]}}}
+        node['id'] = i
+        diagram_nodes[str(i)] = node
+    return {'id': 'bench@0.1.0', 'nodes': diagram_nodes}
+
+
+def wav_bytes(seconds=0.5, rate=44100, tone=440):
+    # a short mono tone, already in the playback format
+    frames = b''.join(struct.pack('<h', int(8000 * math.sin(2 * math.pi * tone * n / rate)))
+                      for n in range(int(seconds * rate)))
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(frames)
+    return out.getvalue()
+
+
+def seed(audios=10000, programs=1000, words_count=20000, categories=20, actions=50, users=10,
+         folder=None, diagram_nodes=12, large_programs=5, large_nodes=2000, audio_files=20, seed_value=0):
+    # with a folder the programs' diagrams and the first audio_files clips
+    # are written to disk too, the first large_programs get large diagrams
+    rng = random.Random(seed_value)
+    start = datetime(2019, 1, 1)
+    audios_folder = os.path.join(folder, 'audios') if folder else '/audios'
+    programs_folder = os.path.join(folder, 'programs') if folder else '/programs'
+
+    def stamp(i):
+        return start + timedelta(seconds=i * 37 + rng.randint(0, 30))
+
+    insert(AudioCategory, [{'id': i + 1, 'name': 'category{}'.format(i), 'modified': stamp(i)}
+                           for i in range(categories)])
+    # one clip in ten is a duplicate upload sharing its file, once the schema allows it
+    dedup = 'content_hash' in columns(Audio)
+    rows = []
+    for i in range(audios):
+        digest = hashlib.sha256(str(i - 1 if dedup and i % 10 == 1 else i).encode()).hexdigest()
+        rows.append({'id': i + 1, 'name': 'audio{}.wav'.format(i), 'content': 'contenido {}'.format(i),
+                     'filepath': os.path.join(audios_folder, digest[:2], digest[2:4], digest + '.wav'),
+                     'content_hash': digest, 'modified': stamp(i),
+                     'category_id': rng.randint(1, categories)})
+    insert(Audio, rows)
+    rows = [{'id': i + 1, 'name': 'program{}'.format(i), 'description': 'programa de prueba {}'.format(i),
+             'filepath': os.path.join(programs_folder, 'program{}.json'.format(i)), 'modified': stamp(i),
+             'active': i == programs // 2} for i in range(programs)]
+    insert(Program, rows)
+    insert(Action, [{'id': i + 1, 'category': 'category{}'.format(i % 5), 'action': 'action{}'.format(i)}
+                    for i in range(actions)])
+    insert(Word, [{'id': i + 1, 'word': w} for i, w in enumerate(words(words_count, rng))])
+    insert(User, [{'id': i + 1, 'username': 'user{}'.format(i), 'email': 'user{}@nayra.test'.format(i),
+                   'last_seen': stamp(i)} for i in range(users)])
+    db.session.commit()
+
+    if folder:
+        os.makedirs(programs_folder, exist_ok=True)
+        for i, row in enumerate(rows):
+            nodes = large_nodes if i < large_programs else diagram_nodes
+            with open(row['filepath'], 'w') as f:
+                json.dump(diagram(nodes, audios, actions, seed_value + i), f)
+        clip = wav_bytes()
+        for filepath, in db.session.query(Audio.filepath).order_by(Audio.id).limit(audio_files):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with open(filepath, 'wb') as f:
+                f.write(clip)
@@ -0,0 +1,159 @@
+"""Capacity of one server process hosting several robot sessions: simulated
+sessions run programs side by side through the http api, each recognition
+taking --delay seconds as if a user answered. Reports runs and recognitions
+per second, run latency and how well the sessions overlap, as JSON.
+
+    python benchmarks/session_bench.py --sessions 1,4,16 --runs 3 --out sessions.json
+    python benchmarks/session_bench.py --sessions 32 --delay 0 --nodes 200   # cpu bound
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def drive(client, session_manager, session_id, program_id, runs, results, poll):
+    # one run after the other on the session, as a kiosk would
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get('/api/sessions/{}/programs/{}/run'.format(session_id, program_id))
+        if response.status_code != 202:
+            results.append({'error': response.get_json()})
+            continue
+        job = session_manager.job(response.get_json()['job'])
+        while not job.isDone():
+            time.sleep(poll)
+        results.append({'ms': (time.perf_counter() - start) * 1000, 'run_ms': job.elapsed() * 1000,
+                        'result': job.result or job.status,
+                        'recognitions': job.robot.player.recognitions})
+
+
+def level(app, session_manager, sessions, programs, args):
+    client = app.test_client()
+    created = []
+    for i in range(sessions):
+        response = client.post('/api/sessions', json={
+            'binding': 'simulated', 'policy': args.policy, 'seed': args.seed + i,
+            'delay': args.delay, 'max_transitions': args.max_transitions})
+        if response.status_code != 201:
+            raise RuntimeError(response.get_json())
+        created.append(response.get_json()['id'])
+
+    results = []
+    threads = [threading.Thread(target=drive, args=(app.test_client(), session_manager, session_id,
+                                                    i % programs + 1, args.runs, results, args.poll))
+               for i, session_id in enumerate(created)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    active_threads = threading.active_count()
+    for session_id in created:
+        client.delete('/api/sessions/' + session_id)
+
+    done = [result for result in results if 'ms' in result]
+    run_ms = [result['run_ms'] for result in done]
+    recognitions = sum(result['recognitions'] for result in done)
+    result = {
+        'runs': len(done),
+        'errors': len(results) - len(done),
+        'wall_s': round(wall, 3),
+        'runs_per_s': round(len(done) / wall, 2),
+        'recognitions_per_s': round(recognitions / wall, 1),
+        'results': sorted(set(result['result'] for result in done)),
+        'threads': active_threads,
+        'rss_peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if done:
+        result.update({
+            'run_p50_ms': round(percentile(run_ms, 0.5), 2),
+            'run_p99_ms': round(percentile(run_ms, 0.99), 2),
+            'request_to_done_p50_ms': round(percentile([r['ms'] for r in done], 0.5), 2),
+            # 1.0 when every session was running a program the whole time
+            'overlap': round(sum(run_ms) / 1000 / (wall * sessions), 3),
+        })
+    if len(done) < len(results):
+        result['first_error'] = next(r['error'] for r in results if 'error' in r)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', default='1,4,16', help='concurrent sessions per level')
+    parser.add_argument('--runs', type=int, default=3, help='runs per session and level')
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds per recognition')
+    parser.add_argument('--nodes', type=int, default=30, help='size of the generated programs')
+    parser.add_argument('--programs', type=int, default=10)
+    parser.add_argument('--policy', default='random', choices=['random', 'first'])
+    parser.add_argument('--max-transitions', type=int, default=200)
+    parser.add_argument('--poll', type=float, default=0.005)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='keep the robot prints')
+    parser.add_argument('--out')
+    args = parser.parse_args()
+    levels = [int(n) for n in args.sessions.split(',')]
+
+    folder = tempfile.mkdtemp(prefix='nayra_sessions_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(folder, 'bench.db')
+    sys.path.insert(0, ROOT)
+    os.chdir(folder)
+
+    import logging
+    from flask_migrate import upgrade
+    from app import app, db
+    from app.sessions import session_manager
+    from benchmarks.seed import seed
+
+    logging.getLogger('alembic').setLevel(logging.WARNING)
+    app.config['PROGRAMS_FOLDER'] = os.path.join(folder, 'programs')
+    session_manager.max_sessions = max(levels) + 1
+    with app.app_context():
+        upgrade(directory=os.path.join(ROOT, 'migrations'))
+        seed(audios=100, programs=args.programs, words_count=100, categories=2, folder=folder,
+             diagram_nodes=args.nodes, large_programs=0, audio_files=0, seed_value=args.seed)
+        db.session.remove()
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'fsm_queued': app.config['FSM_QUEUED'],
+        'nodes': args.nodes,
+        'delay': args.delay,
+        'runs': args.runs,
+        'max_transitions': args.max_transitions,
+        'levels': {},
+    }
+    output = sys.stdout if args.verbose else open(os.devnull, 'w')
+    for sessions in levels:
+        with contextlib.redirect_stdout(output):
+            result = level(app, session_manager, sessions, args.programs, args)
+        report['levels'][sessions] = result
+        print('{:>4} sessions  runs/s={:<8} recognitions/s={:<9} run p50={} p99={} overlap={} errors={}'.format(
+            sessions, result['runs_per_s'], result['recognitions_per_s'], result.get('run_p50_ms'),
+            result.get('run_p99_ms'), result.get('overlap'), result['errors']), file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out if os.path.isabs(args.out) else os.path.join(ROOT, args.out), 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,10 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # pragmas set on every sqlite connection, empty to keep the sqlite default
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
@@ -18,9 +22,52 @@ class Config(object):
     UPLOAD_FOLDER = os.path.join(basedir, 'files')
     AUDIOS_FOLDER = os.path.join(UPLOAD_FOLDER, 'audios')
     PROGRAMS_FOLDER = os.path.join(UPLOAD_FOLDER, 'programs')
+    # uploads are streamed to the content addressed store in chunks of this size
+    AUDIO_UPLOAD_CHUNK = 64 * 1024
+    # audio downloads through the front server (X-Sendfile) instead of uwsgi
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE') is not None
     GRAMMARS_FOLDER = os.path.join(basedir, 'gram')
     GRAMMAR_TEMPLATE = "grammar.txt"
 
+    # compiled programs kept in memory
+    PROGRAM_CACHE_SIZE = int(os.environ.get('PROGRAM_CACHE_SIZE') or 16)
+    # serialised diagrams kept for the program listings
+    PROGRAM_CONTENT_CACHE_SIZE = int(os.environ.get('PROGRAM_CONTENT_CACHE_SIZE') or 256)
+
+    # background program runs
+    RUN_WORKERS = int(os.environ.get('RUN_WORKERS') or 1)
+    RUN_QUEUE_SIZE = int(os.environ.get('RUN_QUEUE_SIZE') or 1)
+    RUN_HISTORY = 100
+    # per run timelines, written in the background and kept for a while
+    TRACE_FOLDER = os.path.join(UPLOAD_FOLDER, 'traces')
+    TRACE_MAX_RUNS = int(os.environ.get('TRACE_MAX_RUNS') or 1000)
+    TRACE_MAX_AGE = int(os.environ.get('TRACE_MAX_AGE') or 30 * 24 * 3600)
+    TRACE_MAX_EVENTS = 20000
+    TRACE_QUEUE_SIZE = 64
+    # robot sessions hosted by one process, the default one included
+    MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS') or 8)
+    # simulated sessions kill runs that loop past this many states
+    SESSION_MAX_TRANSITIONS = 10000
+    # process fsm triggers iteratively instead of recursively
+    FSM_QUEUED = os.environ.get('FSM_QUEUED', '1') != '0'
+
+    # shared voice engine
+    VOICE_CALIBRATION_FILE = os.path.join(UPLOAD_FOLDER, 'voice_calibration.json')
+    VOICE_RECALIBRATE_INTERVAL = int(os.environ.get('VOICE_RECALIBRATE_INTERVAL') or 600)
+    VOICE_WARMUP_TIMEOUT = 30
+    TTS_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, 'tts')
+    TTS_CACHE_MAX_BYTES = int(os.environ.get('TTS_CACHE_MAX_BYTES') or 200 * 1024 * 1024)
+    # memory mapped clips kept open by the player
+    CLIP_CACHE_SIZE = int(os.environ.get('CLIP_CACHE_SIZE') or 64)
+
+    # coalesced last_seen writes and cached logged-in users
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 60)
+    LAST_SEEN_FLUSH_THRESHOLD = 100
+    USER_CACHE_TTL = 30
+
+    # largest page the list resources return
+    API_MAX_PAGE_SIZE = 1000
+
     # for raspi deploy
     RASPI = False
     # cors
@@ -0,0 +1,32 @@
+"""audio content hash
+
+Revision ID: 3f1c2a9d7e54
+Revises: bd89de30b43e
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7e54'
+down_revision = 'bd89de30b43e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('audio', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_audio_content_hash'), 'audio', ['content_hash'], unique=False)
+    # identical uploads share one file
+    op.drop_index('ix_audio_filepath', table_name='audio')
+    op.create_index(op.f('ix_audio_filepath'), 'audio', ['filepath'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_audio_filepath'), table_name='audio')
+    op.create_index('ix_audio_filepath', 'audio', ['filepath'], unique=True)
+    op.drop_index(op.f('ix_audio_content_hash'), table_name='audio')
+    with op.batch_alter_table('audio') as batch_op:
+        batch_op.drop_column('content_hash')
@@ -0,0 +1,55 @@
+"""index audit
+
+Revision ID: 8a4e6d2c1b93
+Revises: 3f1c2a9d7e54
+Create Date: 2026-10-18 11:02:17.524630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e6d2c1b93'
+down_revision = '3f1c2a9d7e54'
+branch_labels = None
+depends_on = None
+
+
+# indexes no query uses, every insert and update paid for them
+UNUSED = [
+    ('action', 'ix_action_action', ['action']),
+    ('action', 'ix_action_category', ['category']),
+    ('audio', 'ix_audio_content', ['content']),
+    ('audio', 'ix_audio_content_hash', ['content_hash']),
+    ('audio', 'ix_audio_modified', ['modified']),
+    ('audio_category', 'ix_audio_category_modified', ['modified']),
+    ('program', 'ix_program_description', ['description']),
+    ('program', 'ix_program_modified', ['modified']),
+    ('voice_command', 'ix_voice_command_modified', ['modified']),
+]
+
+
+def upgrade():
+    for table, name, columns in UNUSED:
+        op.drop_index(name, table_name=table)
+    op.drop_index('ix_program_active', table_name='program')
+
+    op.create_index('ix_action_category_id', 'action', ['category', 'id'], unique=False)
+    op.create_index('ix_audio_category_id_id', 'audio', ['category_id', 'id'], unique=False)
+    op.create_index('ix_audio_modified_id', 'audio', ['modified', 'id'], unique=False)
+    op.create_index('ix_program_modified_id', 'program', ['modified', 'id'], unique=False)
+    op.create_index('ix_program_active', 'program', ['id'], unique=False,
+                    sqlite_where=sa.text('active = 1'))
+
+
+def downgrade():
+    op.drop_index('ix_program_active', table_name='program')
+    op.drop_index('ix_program_modified_id', table_name='program')
+    op.drop_index('ix_audio_modified_id', table_name='audio')
+    op.drop_index('ix_audio_category_id_id', table_name='audio')
+    op.drop_index('ix_action_category_id', table_name='action')
+
+    op.create_index('ix_program_active', 'program', ['active'], unique=False)
+    for table, name, columns in UNUSED:
+        op.create_index(name, table, columns, unique=False)
@@ -1,7 +1,11 @@
+import time
+
 from app import app, db
 from app.models import Word, Action
 
 
+DICTIONARY = "es-ES/pronounciation-dictionary.dict"
+BATCH = 500
 
 actions_list = [
     ['traction', 'adelante'],
@@ -14,28 +18,67 @@ actions_list = [
     ['greet', 'adios']
 ]
 
-# clean
-Word.query.delete()
-Action.query.delete()
+
+def batches(items):
+    items = list(items)
+    for i in range(0, len(items), BATCH):
+        yield items[i:i + BATCH]
+
+
+def read_words(filepath=DICTIONARY):
+    with open(filepath, "r") as f:
+        return set(line.split(" ")[0] for line in f if line.strip())
+
+
+def sync_words(words):
+    # only the difference between the dictionary and the table is written
+    table = Word.__table__
+    current = set(w for (w,) in db.session.query(Word.word))
+    to_insert = sorted(words - current)
+    to_delete = sorted(current - words)
+
+    for batch in batches(to_delete):
+        db.session.execute(table.delete().where(table.c.word.in_(batch)))
+    for batch in batches(to_insert):
+        db.session.execute(table.insert(), [{"word": w} for w in batch])
+    return len(to_insert), len(to_delete)
 
 
-with open("es-ES/pronounciation-dictionary.dict", "r") as f:
-    content = f.read().split("\n")
+def sync_actions(actions):
+    table = Action.__table__
+    wanted = set(tuple(a) for a in actions)
+    current = set()
+    to_delete = []
+    # existing ids are kept so programs keep pointing at the same actions
+    for row in db.session.query(Action.id, Action.category, Action.action).order_by(Action.id):
+        key = (row.category, row.action)
+        if key not in wanted or key in current:
+            to_delete.append(row.id)
+        current.add(key)
+    to_insert = [a for a in actions if tuple(a) not in current]
 
-words = [x.split(" ")[0] for x in content]
+    for batch in batches(to_delete):
+        db.session.execute(table.delete().where(table.c.id.in_(batch)))
+    if to_insert:
+        db.session.execute(table.insert(), [{"category": c, "action": a} for c, a in to_insert])
+    return len(to_insert), len(to_delete)
 
-i = 0
-for word in words:
-    w = Word(word=word)
-    db.session.add(w)
-    i += 1
 
-for action in actions_list:
-    a = Action(category=action[0], action=action[1])
-    db.session.add(a)
+def sync():
+    start = time.time()
+    try:
+        words = read_words()
+        words_result = sync_words(words)
+        actions_result = sync_actions(actions_list)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
 
+    print("palabras: {} insertadas, {} eliminadas".format(*words_result))
+    print("acciones: {} insertadas, {} eliminadas".format(*actions_result))
+    print("sincronizado en {:.2f}s".format(time.time() - start))
 
 
-db.session.commit()
-print("insertadas {} palabras".format(i))
-print("insertadas {} acciones".format(len(actions_list)))
+if __name__ == "__main__":
+    sync()
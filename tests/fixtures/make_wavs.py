@@ -0,0 +1,53 @@
+"""Writes the recognition fixtures: short mono clips whose energy drives the
+vad through each way an utterance ends. Deterministic, rerun after editing.
+
+    python tests/fixtures/make_wavs.py
+"""
+import os
+import math
+import wave
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def silence(rate, seconds):
+    return [0.0] * int(rate * seconds)
+
+
+def tone(rate, seconds, amplitude, freq=440):
+    return [amplitude * math.sin(2 * math.pi * freq * i / rate) for i in range(int(rate * seconds))]
+
+
+def hum(rate, seconds, amplitude, freq=250):
+    # square wave, its rms is the amplitude
+    period = rate // freq
+    return [amplitude if (i // (period // 2)) % 2 else -amplitude for i in range(int(rate * seconds))]
+
+
+def write(name, samples, rate, width):
+    # width 1 is unsigned 8 bit as wav stores it, width 2 signed 16 bit
+    if width == 1:
+        data = bytes(max(0, min(255, 128 + round(sample / 256))) for sample in samples)
+    else:
+        data = b''.join(int(round(sample)).to_bytes(2, 'little', signed=True) for sample in samples)
+    with wave.open(os.path.join(FOLDER, name), 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(width)
+        wf.setframerate(rate)
+        wf.writeframes(data)
+
+
+def main():
+    # a short answer at the decoder rate, ended by the trailing silence
+    write('utterance.wav', silence(16000, 0.3) + tone(16000, 0.6, 8000) + silence(16000, 1.0), 16000, 2)
+    # nobody answers, ended by the start timeout
+    write('silence.wav', silence(8000, 9), 8000, 1)
+    # speech that never pauses, cut at the longest utterance
+    write('long_speech.wav', tone(8000, 11, 10000), 8000, 1)
+    # a room hum below the boot threshold, then a murmur above it that the
+    # adapted noise floor must not take for speech
+    write('noisy_room.wav', hum(8000, 3, 256) + hum(8000, 1, 512) + hum(8000, 5, 256), 8000, 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import os
+import unittest
+
+from app.robot import TestVoice
+from app.vad import EnergyVad
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# the vad decides once per chunk, 64 ms of the 8 kHz fixtures
+SLACK = 0.1
+
+
+def fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+class Hypothesis(object):
+    def __init__(self, hypstr):
+        self.hypstr = hypstr
+
+
+class FakeDecoder(object):
+    # hears 'si' in any audio and keeps how much it was fed per utterance
+
+    def __init__(self):
+        self.fed = None
+        self.utterances = 0
+
+    def start_utt(self):
+        self.fed = 0
+        self.utterances += 1
+
+    def process_raw(self, data, no_search, full_utt):
+        self.fed += len(data)
+
+    def end_utt(self):
+        pass
+
+    def hyp(self):
+        return Hypothesis('si') if self.fed else None
+
+    def seconds(self):
+        return self.fed / 2.0 / TestVoice.DECODER_RATE
+
+
+class RecognizeWavTest(unittest.TestCase):
+    # recognizeWav feeds the fixtures through recognizeStream, the path the
+    # microphone chunks take, with the vad defaults the robot runs with
+
+    def setUp(self):
+        self.voice = TestVoice(warm=False)
+        self.voice.decoder = FakeDecoder()
+        # noise floor of a quiet room, as a fresh calibration leaves it
+        self.voice.r.energy_threshold = 300
+
+    def tearDown(self):
+        self.voice.close()
+
+    def test_utterance_ends_after_trailing_silence(self):
+        self.assertEqual(self.voice.recognizeWav(fixture('utterance.wav')), 'si')
+        self.assertIsNotNone(self.voice.speech_ended)
+        # 0.3 s before the answer, 0.6 s of it and the vad's 0.5 s of silence
+        self.assertAlmostEqual(self.voice.decoder.seconds(), 1.4, delta=SLACK)
+
+    def test_silence_times_out(self):
+        self.assertIsNone(self.voice.recognizeWav(fixture('silence.wav')))
+        self.assertAlmostEqual(self.voice.decoder.seconds(), 8.0, delta=SLACK)
+
+    def test_long_speech_is_cut(self):
+        self.assertEqual(self.voice.recognizeWav(fixture('long_speech.wav')), 'si')
+        self.assertAlmostEqual(self.voice.decoder.seconds(), 10.0, delta=SLACK)
+
+    def test_noise_floor_follows_the_room(self):
+        # the murmur after the hum is louder than the boot threshold, the
+        # floor learned from the hum keeps it from counting as speech
+        self.assertIsNone(self.voice.recognizeWav(fixture('noisy_room.wav')))
+        self.assertAlmostEqual(self.voice.decoder.seconds(), 8.0, delta=SLACK)
+
+    def test_murmur_alone_is_speech(self):
+        vad = EnergyVad(sample_rate=TestVoice.DECODER_RATE, noise_floor=self.voice.r.energy_threshold / 3.0)
+        states = []
+        position = 0.0
+        for chunk in TestVoice.wavChunks(fixture('noisy_room.wav')):
+            # the murmur plays from 3 s to 4 s
+            if 3.0 + SLACK <= position < 4.0 - SLACK:
+                states.append(vad.feed(chunk))
+            position += len(chunk) / 2.0 / TestVoice.DECODER_RATE
+        self.assertIn(EnergyVad.SPEECH, states)
+        self.assertTrue(vad.heard_speech)
+
+    def test_one_utterance_per_recognition(self):
+        self.voice.recognizeWav(fixture('utterance.wav'))
+        self.voice.recognizeWav(fixture('silence.wav'))
+        self.assertEqual(self.voice.decoder.utterances, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.tts_cache import TtsCache
+
+CONFIG = {'rate': 150, 'volume': 0.9}
+
+
+class FakeSynthesis(object):
+    # stands in for pyttsx3 or the cloud client: writes size bytes per phrase
+    # and records what it was asked for
+
+    def __init__(self, size=100):
+        self.size = size
+        self.calls = []
+
+    def __call__(self, text, filepath):
+        self.calls.append(text)
+        with open(filepath, 'wb') as out:
+            out.write(b'\0' * self.size)
+
+
+class TtsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='tts_cache_')
+        self.synthesize = FakeSynthesis()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def get(self, cache, text, **kwargs):
+        args = dict(voice='spanish-latin-am', engine='pyttsx3', audio_config=CONFIG)
+        args.update(kwargs)
+        return cache.get(text, args['voice'], args['engine'], args['audio_config'], self.synthesize, 'wav')
+
+    def test_key(self):
+        key = TtsCache.key('hola', 'spanish-latin-am', 'pyttsx3', CONFIG)
+        self.assertEqual(key, TtsCache.key('hola', 'spanish-latin-am', 'pyttsx3', dict(reversed(list(CONFIG.items())))))
+        for other in (TtsCache.key('chau', 'spanish-latin-am', 'pyttsx3', CONFIG),
+                      TtsCache.key('hola', 'es-ES/FEMALE', 'pyttsx3', CONFIG),
+                      TtsCache.key('hola', 'spanish-latin-am', 'google', CONFIG),
+                      TtsCache.key('hola', 'spanish-latin-am', 'pyttsx3', dict(CONFIG, rate=200))):
+            self.assertNotEqual(key, other)
+
+        cache = TtsCache(self.folder)
+        filepath = self.get(cache, 'hola')
+        self.assertEqual(filepath, os.path.join(self.folder, key + '.wav'))
+        self.assertTrue(os.path.exists(filepath))
+
+    def test_hits_and_misses(self):
+        cache = TtsCache(self.folder)
+        first = self.get(cache, 'hola')
+        self.assertEqual(self.get(cache, 'hola'), first)
+        self.get(cache, 'hola', engine='google')
+        self.assertEqual(self.synthesize.calls, ['hola', 'hola'])
+        self.assertEqual(cache.stats(), {'entries': 2, 'bytes': 200, 'hits': 1, 'misses': 2})
+        # no temporary files left behind
+        self.assertEqual(sorted(os.listdir(self.folder)), sorted(cache.index))
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        cache = TtsCache(self.folder, max_bytes=250)
+        uno, dos = self.get(cache, 'uno'), self.get(cache, 'dos')
+        # uno used again, dos is now the oldest
+        self.get(cache, 'uno')
+        tres = self.get(cache, 'tres')
+        self.assertTrue(os.path.exists(uno))
+        self.assertFalse(os.path.exists(dos))
+        self.assertTrue(os.path.exists(tres))
+        self.assertEqual(cache.stats()['bytes'], 200)
+
+        self.get(cache, 'dos')
+        self.assertEqual(self.synthesize.calls, ['uno', 'dos', 'tres', 'dos'])
+
+    def test_keeps_an_entry_larger_than_the_cache(self):
+        cache = TtsCache(self.folder, max_bytes=250)
+        self.get(cache, 'uno')
+        self.synthesize.size = 300
+        large = self.get(cache, 'una frase muy larga')
+        self.assertTrue(os.path.exists(large))
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_index_rebuilt_from_disk(self):
+        cache = TtsCache(self.folder)
+        filepath = self.get(cache, 'hola')
+        cache = TtsCache(self.folder)
+        self.assertEqual(self.get(cache, 'hola'), filepath)
+        self.assertEqual(self.synthesize.calls, ['hola'])
+        self.assertEqual(cache.stats(), {'entries': 1, 'bytes': 100, 'hits': 1, 'misses': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,8 @@
 from app import app
+from app.voice import voice_engine
+
+# load models and calibrate before the first run is requested
+voice_engine.start()
 
 if __name__ == "__main__":
 	app.run()